@@ -0,0 +1,491 @@
+"""
+Load test of Flash Accounts flows under a real WSGI server.
+
+Starts the app in pre-forked worker processes of a threaded `wsgiref`
+server, with a SQLite database and an in-process asyncio SMTP sink
+receiving all emails. Concurrent virtual users sign up, activate their
+accounts, request password resets and confirm them, reading tokens back
+from the captured emails. Latency percentiles, error rates and sustained
+requests per second are reported for every step and written as JSON.
+
+Usage:
+    python benchmarks/loadtest.py --workers 4 --concurrency 50 --duration 60
+"""
+
+import argparse
+import asyncio
+import collections
+import email
+import email.policy
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import socketserver
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+# filled in `configure`, this module is the root URLconf
+urlpatterns = []
+
+PASSWORD = "loadtestPASSWORD##1"
+NEW_PASSWORD = "loadtestPASSWORD##2"
+
+
+def configure(db_path, smtp_port, fast_hasher):
+    database = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": db_path,
+        # workers write concurrently, lock waits should not fail requests
+        "OPTIONS": {"timeout": 30},
+    }
+    if django.VERSION >= (5, 1):
+        database["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+
+    settings.configure(
+        SECRET_KEY="loadtest",
+        DEBUG=False,
+        ALLOWED_HOSTS=["127.0.0.1"],
+        INSTALLED_APPS=[
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "rest_framework",
+            "flash_accounts",
+        ],
+        DATABASES={"default": database},
+        ROOT_URLCONF="__main__",
+        EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+        EMAIL_HOST="127.0.0.1",
+        EMAIL_PORT=smtp_port,
+        USE_TZ=True,
+        TEMPLATES=[
+            {
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "APP_DIRS": True,
+            }
+        ],
+        PASSWORD_HASHERS=(
+            ["django.contrib.auth.hashers.MD5PasswordHasher"]
+            if fast_hasher
+            else ["django.contrib.auth.hashers.PBKDF2PasswordHasher"]
+        ),
+    )
+    django.setup()
+
+    from django.urls import include, path
+
+    urlpatterns.append(path("", include("flash_accounts.urls")))
+
+
+def migrate():
+    from django.core.management import call_command
+    from django.db import connection, connections
+
+    call_command("migrate", verbosity=0)
+    # readers do not block writers of other workers
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    # workers must not share connections of this process
+    connections.close_all()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve(sock):
+    """
+    Serve the app on a listening socket shared by all workers.
+    """
+
+    from django.core.wsgi import get_wsgi_application
+
+    server = ThreadingWSGIServer(
+        sock.getsockname(), QuietHandler, bind_and_activate=False
+    )
+    server.socket.close()
+    server.socket = sock
+    server.server_name, server.server_port = sock.getsockname()
+    server.setup_environ()
+    server.set_app(get_wsgi_application())
+    server.serve_forever()
+
+
+def start_workers(sock, workers):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=serve, args=(sock,)) for _ in range(workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    return processes
+
+
+class SMTPSink:
+    """
+    Minimal SMTP server storing received messages in a mailbox
+    of every recipient.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.mailboxes = collections.defaultdict(asyncio.Queue)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, sock=self.sock)
+
+    async def handle(self, reader, writer):
+        async def reply(line):
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        await reply("220 loadtest SMTP sink")
+        recipients = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("ascii", "replace").strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    await reply("250 loadtest")
+                elif command.startswith("MAIL FROM"):
+                    recipients = []
+                    await reply("250 OK")
+                elif command.startswith("RCPT TO"):
+                    address = line.decode().split(":", 1)[1].strip()
+                    recipients.append(address.strip("<>").lower())
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    self.deliver(await self.read_data(reader), recipients)
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    # RSET, NOOP and everything else
+                    await reply("250 OK")
+        finally:
+            writer.close()
+
+    async def read_data(self, reader):
+        lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b".\r\n", b".\n", b""):
+                return b"".join(lines)
+            # dot-stuffed lines
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def deliver(self, data, recipients):
+        message = email.message_from_bytes(data, policy=email.policy.default)
+        for recipient in recipients:
+            self.mailboxes[recipient].put_nowait(message)
+
+    async def wait_for_link(self, recipient, timeout):
+        """
+        Returns path of the first link in the next message to recipient.
+        """
+
+        message = await asyncio.wait_for(self.mailboxes[recipient].get(), timeout)
+        text = message.get_body(("plain",)).get_content()
+        url = next(word for word in text.split() if word.startswith("http"))
+        return urlsplit(url).path
+
+
+async def request(port, method, path, data=None):
+    """
+    Send a request over a new connection, returns status code.
+    """
+
+    body = json.dumps(data).encode() if data is not None else b""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: 127.0.0.1:{port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        # responses are read to the end, so connection is closed cleanly
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+class LoadTest:
+    """
+    Virtual users running sign up, activation and password reset flows
+    until the deadline. Latencies and errors are recorded per step.
+    """
+
+    def __init__(self, port, sink, concurrency, duration, email_timeout):
+        self.port = port
+        self.sink = sink
+        self.concurrency = concurrency
+        self.duration = duration
+        self.email_timeout = email_timeout
+        self.latencies = collections.defaultdict(list)
+        self.attempts = collections.Counter()
+        self.errors = collections.defaultdict(collections.Counter)
+        self.flows = 0
+
+    async def step(self, name, method, path, data, expected):
+        """
+        Send a request of given step, returns `True` if it succeeded.
+        """
+
+        self.attempts[name] += 1
+        start = time.perf_counter()
+        try:
+            status = await request(self.port, method, path, data)
+        except OSError as e:
+            self.errors[name][type(e).__name__] += 1
+            return False
+        self.latencies[name].append(time.perf_counter() - start)
+        if status != expected:
+            self.errors[name][str(status)] += 1
+            return False
+        return True
+
+    async def link(self, name, address):
+        """
+        Returns path of the link emailed to address, `None` on timeout.
+        """
+
+        try:
+            return await self.sink.wait_for_link(address, self.email_timeout)
+        except asyncio.TimeoutError:
+            # step is failed without sending a request
+            self.attempts[name] += 1
+            self.errors[name]["email timeout"] += 1
+            return None
+
+    async def flow(self, n):
+        from django.urls import reverse
+
+        from flash_accounts.settings import flash_settings
+
+        username = f"load{n}"
+        address = f"{username}@example.com"
+        data = {
+            "username": username,
+            "email": address,
+            "password": PASSWORD,
+            "password2": PASSWORD,
+        }
+        if not await self.step("sign_up", "POST", reverse("sign_up"), data, 201):
+            return
+
+        if flash_settings.ACTIVATE_ACCOUNT:
+            path = await self.link("activate", address)
+            if path is None or not await self.step("activate", "GET", path, None, 200):
+                return
+
+        data = {"email": address}
+        path = reverse("password_reset")
+        if not await self.step("password_reset", "POST", path, data, 200):
+            return
+
+        path = await self.link("password_reset_confirm", address)
+        if path is not None:
+            data = {"password": NEW_PASSWORD, "password2": NEW_PASSWORD}
+            await self.step("password_reset_confirm", "POST", path, data, 200)
+
+    async def virtual_user(self, deadline, counter):
+        while time.monotonic() < deadline:
+            await self.flow(next(counter))
+            self.flows += 1
+
+    async def run(self):
+        counter = iter(range(sys.maxsize))
+        start = time.monotonic()
+        await asyncio.gather(
+            *(
+                self.virtual_user(start + self.duration, counter)
+                for _ in range(self.concurrency)
+            )
+        )
+        return time.monotonic() - start
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(load_test, elapsed):
+    results = []
+    total_requests, total_errors = 0, 0
+    for name in ("sign_up", "activate", "password_reset", "password_reset_confirm"):
+        latencies = load_test.latencies[name]
+        errors = sum(load_test.errors[name].values())
+        attempts = load_test.attempts[name]
+        if not attempts:
+            continue
+        result = {
+            "name": name,
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": errors / attempts,
+            "error_reasons": dict(load_test.errors[name]),
+            "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+            "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+            "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+            "requests_per_s": len(latencies) / elapsed,
+        }
+        results.append(result)
+        total_requests += len(latencies)
+        total_errors += errors
+
+        def ms(value):
+            return f"{value:8.1f}ms" if value is not None else f"{'-':>10}"
+
+        print(
+            f"{name:<24} {result['requests']:7d} req  "
+            f"{result['error_rate']:6.1%} errors  "
+            f"p50 {ms(result['p50_ms'])}  p95 {ms(result['p95_ms'])}  "
+            f"p99 {ms(result['p99_ms'])}  {result['requests_per_s']:7.1f}/s"
+        )
+        for reason, count in load_test.errors[name].most_common():
+            print(f"{'':<24} {count:7d} x {reason}")
+
+    summary = {
+        "flows": load_test.flows,
+        "requests": total_requests,
+        "errors": total_errors,
+        "elapsed_s": elapsed,
+        "requests_per_s": total_requests / elapsed,
+    }
+    print(
+        f"{load_test.flows} flows, {total_requests} requests, {total_errors} errors "
+        f"in {elapsed:.1f}s, {summary['requests_per_s']:.1f} requests/s sustained"
+    )
+    return results, summary
+
+
+def listen(backlog=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(backlog or socket.SOMAXCONN)
+    return sock
+
+
+async def drive(app_sock, smtp_sock, args):
+    sink = SMTPSink(smtp_sock)
+    await sink.start()
+    load_test = LoadTest(
+        app_sock.getsockname()[1],
+        sink,
+        args.concurrency,
+        args.duration,
+        args.email_timeout,
+    )
+    elapsed = await load_test.run()
+    return load_test, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of server processes, each serving requests in threads.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=20,
+        help="Number of virtual users running flows concurrently.",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30,
+        help="Seconds after which virtual users start no new flows.",
+    )
+    parser.add_argument(
+        "--email-timeout",
+        type=float,
+        default=10,
+        help="Seconds to wait for an email with a link.",
+    )
+    parser.add_argument(
+        "--output",
+        default="loadtest_results.json",
+        help="Path of JSON results file.",
+    )
+    parser.add_argument(
+        "--fast-hasher",
+        action="store_true",
+        help="Use MD5 password hasher to load everything but PBKDF2.",
+    )
+    args = parser.parse_args()
+
+    app_sock, smtp_sock = listen(), listen()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(
+            os.path.join(tmp, "loadtest.sqlite3"),
+            smtp_sock.getsockname()[1],
+            args.fast_hasher,
+        )
+        migrate()
+
+        processes = start_workers(app_sock, args.workers)
+        print(
+            f"Running {args.concurrency} virtual users against {args.workers} "
+            f"workers for {args.duration:.0f}s"
+        )
+        try:
+            load_test, elapsed = asyncio.run(drive(app_sock, smtp_sock, args))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+
+    import flash_accounts
+
+    results, summary = report(load_test, elapsed)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "flash_accounts": flash_accounts.VERSION,
+                    "django": django.get_version(),
+                    "python": platform.python_version(),
+                    "workers": args.workers,
+                    "concurrency": args.concurrency,
+                    "duration": args.duration,
+                    "fast_hasher": args.fast_hasher,
+                },
+                "summary": summary,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
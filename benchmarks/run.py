@@ -0,0 +1,396 @@
+"""
+Benchmarks of Flash Accounts endpoints and services.
+
+Runs against a SQLite database and the locmem email backend. For every
+size, the database is seeded with that many users and tokens, then every
+scenario is measured: latency percentiles, throughput, queries per call
+and peak memory. Results are written as JSON, so releases can be compared.
+
+Usage:
+    python benchmarks/run.py --sizes 1000 100000 1000000 --output results.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+# filled in `configure`, this module is the root URLconf
+urlpatterns = []
+
+PASSWORD = "benchmarkPASSWORD##1"
+SEED_CHUNK_SIZE = 10000
+
+
+def configure(db_path, fast_hasher):
+    settings.configure(
+        SECRET_KEY="benchmark",
+        DEBUG=False,
+        ALLOWED_HOSTS=["testserver"],
+        INSTALLED_APPS=[
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "rest_framework",
+            "flash_accounts",
+        ],
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": db_path}
+        },
+        ROOT_URLCONF="__main__",
+        EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+        USE_TZ=True,
+        TEMPLATES=[
+            {
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "APP_DIRS": True,
+            }
+        ],
+        PASSWORD_HASHERS=(
+            ["django.contrib.auth.hashers.MD5PasswordHasher"]
+            if fast_hasher
+            else ["django.contrib.auth.hashers.PBKDF2PasswordHasher"]
+        ),
+    )
+    django.setup()
+
+    from django.urls import include, path
+
+    urlpatterns.append(path("", include("flash_accounts.urls")))
+
+
+def seed_token_value(prefix, i):
+    return f"{prefix}{i}"
+
+
+def seed(size):
+    """
+    Create `size` users with their email index rows, half of them
+    inactive with activation tokens, the other half with password
+    reset tokens.
+    """
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.utils import timezone
+
+    from flash_accounts.models import ActivationToken, PasswordResetToken, EmailIndex
+
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    expiration_date = timezone.now() + timezone.timedelta(days=1)
+
+    for start in range(0, size, SEED_CHUNK_SIZE):
+        users = User.objects.bulk_create(
+            User(
+                username=f"user{i}",
+                email=f"user{i}@example.com",
+                password=password,
+                is_active=bool(i % 2),
+            )
+            for i in range(start, min(start + SEED_CHUNK_SIZE, size))
+        )
+        # some databases do not return primary keys from bulk insert
+        if users[0].pk is None:
+            users = list(User.objects.filter(username__in=[u.username for u in users]))
+
+        # users are looked up by email through the index
+        EmailIndex.objects.bulk_create(
+            EmailIndex(user=user, email=EmailIndex.normalize(user.email))
+            for user in users
+        )
+
+        activation, reset = [], []
+        for user in users:
+            i = int(user.username[4:])
+            token_class, tokens = (
+                (PasswordResetToken, reset) if i % 2 else (ActivationToken, activation)
+            )
+            digest = hashlib.sha256(seed_token_value("t", i).encode()).hexdigest()
+            tokens.append(
+                token_class(user=user, digest=digest, expiration_date=expiration_date)
+            )
+        ActivationToken.objects.bulk_create(activation)
+        PasswordResetToken.objects.bulk_create(reset)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(name, size, calls):
+    """
+    Run every callable from `calls` once and return measurements.
+    At least three calls are needed. Peak memory is that of the second
+    call, a single representative call after caches are warm.
+    """
+
+    from django.core import mail
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies = []
+    queries = 0
+
+    # first call warms caches, second one is traced for peak memory only,
+    # tracing would slow down measured calls
+    mail.outbox = []
+    calls[0]()
+    mail.outbox = []
+    tracemalloc.start()
+    calls[1]()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for call in calls[2:]:
+        mail.outbox = []
+        with CaptureQueriesContext(connection) as captured:
+            call_start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - call_start)
+        queries += len(captured)
+    total = time.perf_counter() - start
+
+    return {
+        "name": name,
+        "size": size,
+        "calls": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "throughput_per_s": len(latencies) / total,
+        "queries_per_call": queries / len(latencies),
+        "peak_memory_kb": peak_memory / 1024,
+    }
+
+
+def check_status(response, expected):
+    if response.status_code != expected:
+        raise RuntimeError(
+            f"{response.request['PATH_INFO']} returned {response.status_code}, "
+            f"expected {expected}: {response.content[:200]}"
+        )
+
+
+def scenarios(size, iterations):
+    """
+    Returns `(name, calls)` pairs, every call is measured separately.
+    """
+
+    from django.contrib.auth import get_user_model
+    from django.test import RequestFactory
+    from django.urls import reverse
+
+    from rest_framework.test import APIClient
+
+    from flash_accounts.models import ActivationToken, PasswordResetToken
+    from flash_accounts.tokens import ModelTokenBackend
+    from flash_accounts import services
+
+    User = get_user_model()
+    client = APIClient()
+    request = RequestFactory().get("/")
+    n = min(iterations + 2, size // 2)
+
+    # even users are inactive with activation token,
+    # odd users are active with password reset token
+    inactive = [2 * i for i in range(n)]
+    active = [2 * i + 1 for i in range(n)]
+
+    def sign_up(i):
+        response = client.post(
+            reverse("sign_up"),
+            {
+                "username": f"new{i}",
+                "email": f"new{i}@example.com",
+                "password": PASSWORD,
+                "password2": PASSWORD,
+            },
+        )
+        check_status(response, 201)
+
+    def activate(i):
+        url = reverse("activate", kwargs={"token_value": seed_token_value("t", i)})
+        check_status(client.get(url), 200)
+
+    def activate_resend(i):
+        response = client.post(
+            reverse("activate_resend"), {"email": f"user{i}@example.com"}
+        )
+        check_status(response, 200)
+
+    def password_reset(i):
+        response = client.post(
+            reverse("password_reset"), {"email": f"user{i}@example.com"}
+        )
+        check_status(response, 200)
+
+    def password_reset_confirm(i):
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": seed_token_value("t", i)},
+        )
+        response = client.post(url, {"password": PASSWORD, "password2": PASSWORD})
+        check_status(response, 200)
+
+    backend = ModelTokenBackend()
+    users = list(User.objects.filter(username__in=[f"user{i}" for i in inactive]))
+
+    def send_mail_with_token(i):
+        services.send_mail_with_token(
+            to_email=f"user{i}@example.com",
+            username=f"user{i}",
+            url=f"http://testserver/account/activate/{i}/",
+            host="testserver",
+            template_name="flash_accounts/activate",
+            subject="Activate your account.",
+        )
+
+    return [
+        ("sign_up", [lambda i=i: sign_up(i) for i in range(n)]),
+        ("activate_resend", [lambda i=i: activate_resend(i) for i in inactive]),
+        ("password_reset", [lambda i=i: password_reset(i) for i in active]),
+        # resend and reset replaced seeded tokens, so they are seeded again
+        ("reseed", [lambda: reseed(inactive, active)]),
+        ("activate", [lambda i=i: activate(i) for i in inactive]),
+        (
+            "password_reset_confirm",
+            [lambda i=i: password_reset_confirm(i) for i in active],
+        ),
+        (
+            "generate_token",
+            [ActivationToken().generate_token for _ in range(iterations + 2)],
+        ),
+        (
+            "create_token",
+            [
+                lambda user=user: backend.create_token(PasswordResetToken, user)
+                for user in users
+            ],
+        ),
+        (
+            "send_mail_with_token",
+            [lambda i=i: send_mail_with_token(i) for i in range(iterations + 2)],
+        ),
+        (
+            "build_url",
+            [
+                lambda: services.build_url(request, "activate", "x" * 55)
+                for _ in range(iterations + 2)
+            ],
+        ),
+    ]
+
+
+def reseed(inactive, active):
+    from flash_accounts.models import ActivationToken, PasswordResetToken
+
+    for token_class, users in (
+        (ActivationToken, inactive),
+        (PasswordResetToken, active),
+    ):
+        for i in users:
+            digest = hashlib.sha256(seed_token_value("t", i).encode()).hexdigest()
+            token_class.objects.filter(user__username=f"user{i}").update(digest=digest)
+
+
+def run_size(size, iterations):
+    from django.core.management import call_command
+    from django.db import connection
+
+    # start every size from an empty database
+    call_command("migrate", verbosity=0)
+    call_command("flush", interactive=False, verbosity=0)
+
+    seed_start = time.perf_counter()
+    seed(size)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    print(f"Seeded {size} users in {time.perf_counter() - seed_start:.1f}s")
+
+    results = []
+    for name, calls in scenarios(size, iterations):
+        if name == "reseed":
+            calls[0]()
+            continue
+        result = measure(name, size, calls)
+        results.append(result)
+        print(
+            f"{name:<24} p50 {result['p50_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms  "
+            f"{result['throughput_per_s']:9.0f}/s  "
+            f"{result['queries_per_call']:5.1f} queries  "
+            f"{result['peak_memory_kb']:9.0f}KB"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Numbers of seeded users, e.g. 1000 100000 1000000.",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=200,
+        help="Number of measured calls of every scenario.",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="Path of JSON results file.",
+    )
+    parser.add_argument(
+        "--fast-hasher",
+        action="store_true",
+        help="Use MD5 password hasher to measure everything but PBKDF2.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(os.path.join(tmp, "benchmark.sqlite3"), args.fast_hasher)
+
+        import flash_accounts
+
+        results = []
+        for size in args.sizes:
+            results += run_size(size, args.iterations)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "flash_accounts": flash_accounts.VERSION,
+                    "django": django.get_version(),
+                    "python": platform.python_version(),
+                    "iterations": args.iterations,
+                    "fast_hasher": args.fast_hasher,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
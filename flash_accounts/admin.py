@@ -1,3 +1,135 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils import timezone
 
-# Register your models here.
+from .models import ActivationToken, PasswordResetToken, EmailIndex
+from .settings import flash_settings
+from . import services
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which does not count all rows of large tables.
+
+    Count of unfiltered PostgreSQL table is estimated from planner
+    statistics, other counts stop at `max_count` rows.
+    """
+
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate_count(queryset)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        return queryset[: self.max_count].count()
+
+    def estimate_count(self, queryset):
+        """
+        Returns estimated number of rows of queryset table
+        or `None` if database does not provide estimates.
+        """
+
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+class TokenStatusFilter(admin.SimpleListFilter):
+    """
+    Filter tokens by expiry, served by index on expiration date.
+    """
+
+    title = "status"
+    parameter_name = "status"
+
+    def lookups(self, request, model_admin):
+        return [("pending", "Pending"), ("expired", "Expired")]
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        if self.value() == "pending":
+            return queryset.filter(expiration_date__gte=now)
+        if self.value() == "expired":
+            return queryset.filter(expiration_date__lt=now)
+        return queryset
+
+
+class TokenAdmin(admin.ModelAdmin):
+    """
+    Admin of token tables with millions of rows.
+
+    Users are joined to listed tokens and picked by primary key,
+    rows are searched by exact email through email index
+    and pages are not counted in full. Bulk actions take
+    one statement per batch of tokens.
+    """
+
+    list_display = ["id", "user", "user_email", "expiration_date", "is_expired"]
+    list_select_related = ["user"]
+    list_filter = [TokenStatusFilter]
+    ordering = ["-pk"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ["user"]
+    readonly_fields = ["digest", "created_at", "updated_at"]
+    search_fields = ["user__email_index__email"]
+    search_help_text = "Exact email address."
+    actions = ["reissue_and_resend", "expire_now"]
+
+    @admin.display(description="email")
+    def user_email(self, token):
+        return token.user.email
+
+    @admin.display(description="expired", boolean=True)
+    def is_expired(self, token):
+        return token.expiration_date is not None and token.expired
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Look up tokens by exact normalized email, so search
+        is served by email index instead of a full scan.
+        """
+
+        if not search_term:
+            return queryset, False
+        email = EmailIndex.normalize(search_term)
+        return queryset.filter(user__email_index__email=email), False
+
+    @admin.action(description="Reissue and resend selected tokens")
+    def reissue_and_resend(self, request, queryset):
+        # links must point to the public site, not to the admin host
+        base_url = flash_settings.PUBLIC_BASE_URL
+        if not base_url:
+            self.message_user(
+                request,
+                "Set PUBLIC_BASE_URL setting to resend tokens.",
+                level=messages.ERROR,
+            )
+            return
+
+        reissued, failed = services.reissue_and_send_tokens(queryset, base_url)
+        self.message_user(
+            request, f"Reissued {reissued} tokens, {failed} emails failed to send."
+        )
+
+    @admin.action(description="Expire selected tokens now")
+    def expire_now(self, request, queryset):
+        expired = services.expire_tokens(queryset)
+        self.message_user(request, f"Expired {expired} tokens.")
+
+
+admin.site.register(ActivationToken, TokenAdmin)
+admin.site.register(PasswordResetToken, TokenAdmin)
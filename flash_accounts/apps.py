@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class FlashAccountsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "flash_accounts"
+
+    def ready(self):
+        from .mail_templates import email_templates
+        from . import signals  # noqa: F401
+
+        email_templates.warm()
@@ -0,0 +1,43 @@
+"""
+URLconf with async views, include it instead of `flash_accounts.urls`
+in ASGI deployments.
+"""
+
+from django.urls import path
+
+from .settings import flash_settings
+from . import async_views
+
+# Registration
+urlpatterns = [
+    path("sign-up/", async_views.sign_up, name="sign_up"),
+]
+
+# Account activation
+if flash_settings.ACTIVATE_ACCOUNT:
+    urlpatterns += [
+        path(
+            "account/activate/<str:token_value>/",
+            async_views.activate_account,
+            name="activate",
+        ),
+        path(
+            "account/activate-resend/",
+            async_views.account_activation_resend,
+            name="activate_resend",
+        ),
+    ]
+
+# Password reset
+urlpatterns += [
+    path(
+        "password-reset/",
+        async_views.password_reset_request,
+        name="password_reset",
+    ),
+    path(
+        "password-reset/confirm/<str:token_value>/",
+        async_views.password_reset_confirm,
+        name="password_reset_confirm",
+    ),
+]
@@ -0,0 +1,235 @@
+"""
+Async versions of Flash Accounts views, for ASGI deployments.
+
+Django REST framework does not support async views, so these are plain
+Django views returning the same responses as views in `views.py`.
+Requires Django 4.2 or newer.
+"""
+
+from django.contrib.auth import get_user_model
+from django.http import Http404, JsonResponse
+
+from asgiref.sync import sync_to_async
+from rest_framework import status
+
+from .throttling import IPRateThrottle, EmailRateThrottle
+from .serializers import UserCreateSerializer, EmailSerializer, PasswordResetSerializer
+from .tokens import TokenExpiredError
+from . import services
+
+import functools
+import json
+
+
+User = get_user_model()
+
+
+def async_api_view(http_method_names):
+    """
+    Like `rest_framework.decorators.api_view`, for async view functions:
+    rejects not allowed methods and exempts view from CSRF checks.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                return JsonResponse(
+                    {"detail": f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+            return await view(request, *args, **kwargs)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+class ThrottledRequest:
+    """
+    Minimal request object for throttle classes.
+    """
+
+    def __init__(self, request, data):
+        self.META = request.META
+        self.data = data
+
+
+def get_request_data(request):
+    """
+    Returns data sent as JSON or as form.
+    Raises `ValueError` if JSON is malformed.
+    """
+
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    return request.POST
+
+
+def throttle(request, data):
+    """
+    Returns 429 response if request should be throttled.
+    """
+
+    throttled_request = ThrottledRequest(request, data)
+    for throttle_class in (IPRateThrottle, EmailRateThrottle):
+        throttle = throttle_class()
+        if not throttle.allow_request(throttled_request, None):
+            wait = throttle.wait()
+            detail = "Request was throttled."
+            if wait is not None:
+                detail += f" Expected available in {int(wait) + 1} seconds."
+            return JsonResponse(
+                {"detail": detail}, status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+
+def not_found():
+    return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+def parse_error():
+    return JsonResponse(
+        {"detail": "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+@async_api_view(["POST"])
+async def sign_up(request):
+    """
+    Create user account and send mail with activation link.
+    """
+
+    try:
+        data = get_request_data(request)
+    except ValueError:
+        return parse_error()
+
+    serializer = UserCreateSerializer(data=data)
+    # uniqueness validators query the database
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    await services.acreate_user(serializer, request)
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["GET"])
+async def activate_account(request, token_value):
+    """
+    Activate user account if activation token is valid.
+    """
+
+    try:
+        await services.aactivate_account_with_token(token_value)
+    except Http404:
+        return not_found()
+    except TokenExpiredError:
+        return JsonResponse(
+            {"token": "token has expired."}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return JsonResponse({"account": "Account activated."}, status=status.HTTP_200_OK)
+
+
+@async_api_view(["POST"])
+async def password_reset_request(request):
+    """
+    Obtain email address, create password reset token
+    and send email with instructions.
+    """
+
+    try:
+        data = get_request_data(request)
+    except ValueError:
+        return parse_error()
+
+    throttled = throttle(request, data)
+    if throttled:
+        return throttled
+
+    serializer = EmailSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    email = serializer.data["email"]
+    user = await services.aget_user_by_email(email)
+    if user is None:
+        return not_found()
+
+    await services.acreate_and_send_password_reset_token(user, request)
+
+    return JsonResponse(
+        {"response": f"Email with instructions has been sent to {email}"},
+        status=status.HTTP_200_OK,
+    )
+
+
+@async_api_view(["POST"])
+async def account_activation_resend(request):
+    """
+    Obtain email address, create activation token
+    and send email with instructions.
+    Check if user account is already activated.
+    """
+
+    try:
+        data = get_request_data(request)
+    except ValueError:
+        return parse_error()
+
+    throttled = throttle(request, data)
+    if throttled:
+        return throttled
+
+    serializer = EmailSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    email = serializer.data["email"]
+    user = await services.aget_user_by_email(email)
+    if user is None:
+        return not_found()
+
+    if user.is_active:
+        return JsonResponse(
+            {"account": "Account already activated."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    await services.acreate_and_send_activation_token(user, request)
+    return JsonResponse(
+        {"response": f"Email with instructions has been sent to {email}"},
+        status=status.HTTP_200_OK,
+    )
+
+
+@async_api_view(["POST"])
+async def password_reset_confirm(request, token_value):
+    """
+    Set new password if token and serializer data is valid.
+    """
+
+    try:
+        data = get_request_data(request)
+    except ValueError:
+        return parse_error()
+
+    serializer = PasswordResetSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    new_password = serializer.validated_data["password"]
+    try:
+        await services.areset_password_with_token(token_value, new_password)
+    except Http404:
+        return not_found()
+    except TokenExpiredError:
+        return JsonResponse(
+            {"token": "token has expired."}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return JsonResponse(
+        {"password": "Password has been changed."}, status=status.HTTP_200_OK
+    )
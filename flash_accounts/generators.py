@@ -0,0 +1,120 @@
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from .settings import flash_settings
+
+from collections import deque
+import threading
+import os
+
+
+class SecretsTokenGenerator:
+    """
+    Generates random tokens from `os.urandom` bytes.
+
+    Random bytes are mapped to the alphabet in bulk, with bytes which
+    would make some characters more probable than others thrown away.
+    """
+
+    def __init__(self, length=None, alphabet=None) -> None:
+        self.length = length or flash_settings.TOKEN_LENGTH
+        self.alphabet = alphabet or flash_settings.TOKEN_ALPHABET
+
+        if not 1 < len(self.alphabet) <= 128 or not self.alphabet.isascii():
+            raise ValueError("Token alphabet must have 2 to 128 ASCII characters.")
+        if len(set(self.alphabet)) != len(self.alphabet):
+            raise ValueError("Token alphabet must not contain repeated characters.")
+
+        size = len(self.alphabet)
+        # the highest multiple of alphabet size, that fits in a byte
+        self.limit = 256 - 256 % size
+        self.table = bytes(ord(self.alphabet[byte % size]) for byte in range(256))
+        self.rejected = bytes(range(self.limit, 256))
+
+    def generate(self):
+        """
+        Returns a single token.
+        """
+
+        return self.generate_many(1)[0]
+
+    def generate_many(self, count):
+        """
+        Returns a list of `count` tokens.
+        """
+
+        needed = count * self.length
+        chars = b""
+        while len(chars) < needed:
+            missing = needed - len(chars)
+            # draw a bit more, as some bytes are rejected
+            random_bytes = os.urandom(missing * 256 // self.limit + 16)
+            chars += random_bytes.translate(self.table, self.rejected)
+
+        text = chars[:needed].decode("ascii")
+        return [text[i : i + self.length] for i in range(0, needed, self.length)]
+
+
+class PooledTokenGenerator(SecretsTokenGenerator):
+    """
+    Serves tokens from a pool, which is filled in bulk
+    with `TOKEN_POOL_SIZE` tokens whenever it runs empty.
+    """
+
+    def __init__(self, length=None, alphabet=None, pool_size=None) -> None:
+        super().__init__(length, alphabet)
+        self.pool_size = pool_size or flash_settings.TOKEN_POOL_SIZE
+        self.lock = threading.Lock()
+        self.pool = deque()
+        self.pid = None
+        self.fill()
+
+    def fill(self):
+        """
+        Refill the pool.
+        """
+
+        with self.lock:
+            # forked processes must not issue the same tokens as their parent
+            if self.pid != os.getpid():
+                self.pool.clear()
+                self.pid = os.getpid()
+            if not self.pool:
+                self.pool.extend(self.generate_many(self.pool_size))
+
+    def generate(self):
+        while True:
+            if self.pid == os.getpid():
+                try:
+                    return self.pool.popleft()
+                except IndexError:
+                    pass
+            self.fill()
+
+
+_generator = None
+
+
+def get_token_generator():
+    """
+    Returns instance of token generator declared in `TOKEN_GENERATOR` setting.
+    """
+
+    global _generator
+    if _generator is None:
+        _generator = import_string(flash_settings.TOKEN_GENERATOR)()
+    return _generator
+
+
+def reset_token_generator(*args, **kwargs):
+    """
+    Create token generator again if user changed app settings.
+    """
+
+    global _generator
+    if kwargs["setting"] == "FLASH_SETTINGS":
+        _generator = None
+
+
+# signal
+setting_changed.connect(reset_token_generator)
@@ -0,0 +1,141 @@
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+
+from rest_framework.response import Response
+from rest_framework import status
+
+from .settings import flash_settings
+from . import metrics
+
+import hashlib
+import json
+import time
+
+
+class IdempotencyStore:
+    """
+    Stores responses of requests sent with `Idempotency-Key` header
+    in cache declared in `IDEMPOTENCY_CACHE` setting.
+
+    Retries with the same key get stored response without running
+    the view again. Concurrent duplicates wait for the first request
+    to finish. Requests without the header, or with the store disabled,
+    are handled as usual.
+    """
+
+    key_prefix = "flash_accounts.idempotency"
+    header = "Idempotency-Key"
+    max_key_length = 255
+    # seconds between checks for response of concurrent request
+    poll_interval = 0.05
+
+    @property
+    def enabled(self):
+        return bool(flash_settings.IDEMPOTENCY_CACHE)
+
+    @property
+    def cache(self):
+        return caches[flash_settings.IDEMPOTENCY_CACHE]
+
+    def make_keys(self, idempotency_key):
+        """
+        Returns cache keys of response and lock of given idempotency key.
+        """
+
+        # idempotency key may contain characters not allowed in cache keys
+        ident = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        key = f"{self.key_prefix}.{ident}"
+        return key, f"{key}.lock"
+
+    def fingerprint(self, request):
+        """
+        Returns digest of request data, so key reused with other data
+        can be told apart from a retry.
+
+        Digest is keyed on `SECRET_KEY`, so passwords in request data
+        cannot be guessed from it.
+        """
+
+        data = json.dumps(request.data, sort_keys=True, default=str)
+        return salted_hmac(
+            self.key_prefix, f"{request.path}{data}", algorithm="sha256"
+        ).hexdigest()
+
+    def handle(self, request, handler):
+        """
+        Returns stored response or response of `handler()`,
+        which is stored for `IDEMPOTENCY_KEY_TTL`.
+        """
+
+        idempotency_key = request.headers.get(self.header)
+        if not self.enabled or not idempotency_key:
+            return handler()
+        if len(idempotency_key) > self.max_key_length:
+            return Response(
+                {"detail": f"{self.header} header is too long."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        key, lock_key = self.make_keys(idempotency_key)
+        fingerprint = self.fingerprint(request)
+        lock_timeout = flash_settings.IDEMPOTENCY_LOCK_TIMEOUT.total_seconds()
+
+        deadline = time.monotonic() + lock_timeout
+        stored = self.cache.get(key)
+        while stored is None and not self.cache.add(lock_key, True, lock_timeout):
+            if time.monotonic() >= deadline:
+                return Response(
+                    {"detail": "A request with this key is being processed."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            # lock is taken again, when concurrent request failed
+            stored = self.wait(key, lock_key, deadline)
+        if stored is not None:
+            return self.replay(stored, fingerprint)
+
+        try:
+            response = handler()
+            # server errors may be retried
+            if response.status_code < 500:
+                stored = (fingerprint, response.status_code, response.data)
+                ttl = flash_settings.IDEMPOTENCY_KEY_TTL.total_seconds()
+                self.cache.set(key, stored, ttl)
+        finally:
+            self.cache.delete(lock_key)
+        return response
+
+    def wait(self, key, lock_key, deadline):
+        """
+        Wait for response of concurrent request with the same key.
+        Returns stored response, or `None` when that request released
+        its lock without storing a response or on deadline.
+        """
+
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            # response is stored before lock is released
+            locked = self.cache.get(lock_key) is not None
+            stored = self.cache.get(key)
+            if stored is not None or not locked:
+                return stored
+        return None
+
+    def replay(self, stored, fingerprint):
+        """
+        Returns stored response, or error if key was used with other data.
+        """
+
+        stored_fingerprint, status_code, data = stored
+        if stored_fingerprint != fingerprint:
+            return Response(
+                {"detail": f"{self.header} was used with other request data."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+
+        metrics.increment("idempotent_replay")
+        return Response(
+            data, status=status_code, headers={"Idempotent-Replayed": "true"}
+        )
+
+
+idempotency_store = IdempotencyStore()
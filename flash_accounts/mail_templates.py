@@ -0,0 +1,201 @@
+from django.template.base import render_value_in_context
+from django.template import Context, TemplateDoesNotExist
+from django.template.loader import get_template
+from django.core.signals import setting_changed
+from django.utils.html import conditional_escape
+
+from .settings import flash_settings
+
+import re
+
+SIMPLE_PLACEHOLDER = re.compile(r"{{\s*(\w+)\s*}}")
+
+
+class CompiledTemplate:
+    """
+    Template loaded once and rendered many times.
+
+    Templates consisting only of text and `{{ variable }}` placeholders
+    are rendered without walking Django template nodes.
+    """
+
+    def __init__(self, template):
+        self.backend_template = template
+        # `django.template.base.Template` for Django templates backend
+        self.template = getattr(template, "template", None)
+        self.parts = self.split_placeholders()
+
+    def split_placeholders(self):
+        """
+        Returns template source split into text and variable names,
+        or `None` if template is not simple.
+        """
+
+        if self.template is None or self.template.engine.string_if_invalid:
+            return None
+
+        source = self.template.source
+        if "{%" in source or "{#" in source:
+            return None
+
+        # odd items are variable names
+        parts = SIMPLE_PLACEHOLDER.split(source)
+        if any("{{" in part for part in parts[::2]):
+            return None
+        return parts
+
+    def render(self, context):
+        """
+        Render template with given `Context`.
+        """
+
+        if self.parts is not None:
+            return "".join(
+                (
+                    render_value_in_context(context.get(part, ""), context)
+                    if i % 2
+                    else part
+                )
+                for i, part in enumerate(self.parts)
+            )
+
+        if self.template is not None:
+            return self.template.render(context)
+
+        return self.backend_template.render(context.flatten())
+
+
+class PersonalizedTemplate:
+    """
+    Email part rendered once for shared context, with per-recipient
+    fields substituted into it by joining strings.
+    """
+
+    def __init__(self, parts, autoescape):
+        # odd items are field names
+        self.parts = parts
+        self.autoescape = autoescape
+
+    def render(self, values):
+        """
+        Returns email part with given per-recipient field values.
+        """
+
+        escape = conditional_escape if self.autoescape else str
+        return "".join(
+            escape(values[part]) if i % 2 else part for i, part in enumerate(self.parts)
+        )
+
+
+class EmailTemplateCache:
+    """
+    Cache of compiled `.txt` and `.html` email templates.
+    """
+
+    def __init__(self) -> None:
+        self._templates = {}
+
+    def get(self, template_name):
+        """
+        Returns compiled `(txt, html)` templates pair, loads it if needed.
+        """
+
+        try:
+            return self._templates[template_name]
+        except KeyError:
+            pass
+
+        templates = (
+            CompiledTemplate(get_template(f"{template_name}.txt")),
+            CompiledTemplate(get_template(f"{template_name}.html")),
+        )
+        self._templates[template_name] = templates
+        return templates
+
+    def render(self, template_name, context):
+        """
+        Render both parts of email from one context.
+        Returns `(text_content, html_content)` tuple.
+        """
+
+        txt, html = self.get(template_name)
+        autoescape = html.template.engine.autoescape if html.template else True
+        context = Context(context, autoescape=autoescape)
+
+        return txt.render(context), html.render(context)
+
+    def personalize(self, template_name, context, fields):
+        """
+        Render both parts of email once with given shared context,
+        leaving per-recipient `fields` to be substituted later.
+
+        Returns `(text, html)` pair of `PersonalizedTemplate`, or `None`
+        if template does not output the fields as they are, e.g. passes
+        them through filters or tags. Templates are then rendered
+        for every recipient with `render`.
+        """
+
+        # markers of different lengths, so output depending on
+        # field values, e.g. on their length, is detected
+        rendered = []
+        for size in (1, 2):
+            markers = {field: f"\x1e{field}{'~' * size}\x1e" for field in fields}
+            fields_by_marker = {marker: field for field, marker in markers.items()}
+            pattern = "(" + "|".join(map(re.escape, fields_by_marker)) + ")"
+
+            split = []
+            for output in self.render(template_name, {**context, **markers}):
+                pieces = re.split(pattern, output)
+                # odd items are markers, replaced with field names
+                split.append(
+                    [
+                        fields_by_marker[piece] if i % 2 else piece
+                        for i, piece in enumerate(pieces)
+                    ]
+                )
+            rendered.append(split)
+
+        if rendered[0] != rendered[1]:
+            return None
+
+        _, html = self.get(template_name)
+        autoescape = html.template.engine.autoescape if html.template else True
+        return tuple(PersonalizedTemplate(parts, autoescape) for parts in rendered[0])
+
+    def warm(self):
+        """
+        Load templates declared in settings.
+        Missing templates are reported when email is sent.
+        """
+
+        for template_name in (
+            flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+            flash_settings.PASSWORD_RESET_EMAIL_TEMPLATE,
+        ):
+            try:
+                self.get(template_name)
+            except TemplateDoesNotExist:
+                pass
+
+    def clear(self):
+        """
+        Remove all compiled templates.
+        """
+
+        self._templates.clear()
+
+
+email_templates = EmailTemplateCache()
+
+
+def clear_email_templates(*args, **kwargs):
+    """
+    Clear templates cache if user changed app or templates settings.
+    """
+
+    if kwargs["setting"] in ("FLASH_SETTINGS", "TEMPLATES"):
+        email_templates.clear()
+
+
+# signal
+setting_changed.connect(clear_email_templates)
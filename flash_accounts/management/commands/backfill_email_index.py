@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from flash_accounts import services
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Write missing and outdated email index rows of existing users in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of users indexed at once.",
+        )
+        parser.add_argument(
+            "--after-pk",
+            default=0,
+            help="Index only users with greater primary key, to resume a run.",
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Stop after that many seconds, resume with printed --after-pk.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        deadline = None
+        if options["max_seconds"] is not None:
+            deadline = time.monotonic() + options["max_seconds"]
+
+        after_pk = options["after_pk"]
+        written = 0
+        start = time.monotonic()
+        while deadline is None or time.monotonic() < deadline:
+            last_pk, chunk = services.backfill_email_index(
+                after_pk, options["chunk_size"], options["database"]
+            )
+            if last_pk is None:
+                after_pk = None
+                break
+            after_pk = last_pk
+            written += chunk
+
+        elapsed = time.monotonic() - start
+        rate = written / elapsed if elapsed else 0
+        self.stdout.write(f"Indexed {written} users ({rate:.0f} rows/s).")
+        if after_pk is not None:
+            self.stdout.write(f"Not finished, resume with --after-pk {after_pk}.")
@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+
+from flash_accounts.models import TokenKind
+from flash_accounts import services
+
+import argparse
+import datetime
+import time
+
+
+def parse_moment(value):
+    """
+    Parse ISO date or datetime argument, naive values are
+    interpreted in current time zone.
+    """
+
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise argparse.ArgumentTypeError(f"Invalid date: {value}")
+        moment = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Stream CSV or JSONL export of tokens joined with fields of their users."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=TokenKind.values, help="Token kind.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            default="csv",
+            help="Output format, CSV by default.",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Path of written file, standard output by default.",
+        )
+        parser.add_argument(
+            "--expires-after",
+            type=parse_moment,
+            default=None,
+            help="Only tokens expiring at or after that date.",
+        )
+        parser.add_argument(
+            "--expires-before",
+            type=parse_moment,
+            default=None,
+            help="Only tokens expiring before that date.",
+        )
+        parser.add_argument(
+            "--created-after",
+            type=parse_moment,
+            default=None,
+            help="Only tokens created at or after that date.",
+        )
+        parser.add_argument(
+            "--created-before",
+            type=parse_moment,
+            default=None,
+            help="Only tokens created before that date.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of rows fetched from the database at once.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, REPLICA_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        exported = 0
+
+        def count(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        try:
+            rows = services.export_tokens(
+                services.TOKEN_CLASSES[options["kind"]],
+                expires_after=options["expires_after"],
+                expires_before=options["expires_before"],
+                created_after=options["created_after"],
+                created_before=options["created_before"],
+                chunk_size=options["chunk_size"],
+                using=options["database"],
+            )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        lines = services.format_rows(
+            count(rows), options["format"], services.TOKEN_EXPORT_COLUMNS
+        )
+
+        start = time.monotonic()
+        try:
+            if options["output"] is None:
+                for line in lines:
+                    self.stdout.write(line, ending="")
+            else:
+                with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                    f.writelines(lines)
+        except OSError as e:
+            raise CommandError(f"Cannot write export: {e}")
+
+        elapsed = time.monotonic() - start
+        # keep standard output clean, when export is written to it
+        report = self.stdout if options["output"] else self.stderr
+        report.write(
+            f"Exported {exported} tokens "
+            f"({exported / elapsed if elapsed else 0:.0f} rows/s)."
+        )
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flash_accounts import services
+
+import json
+import time
+import csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users from a CSV or JSONL file with `username`, `email` "
+        "and optional `password` columns, and send activation emails."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path to CSV or JSONL file.")
+        parser.add_argument(
+            "--base-url",
+            required=True,
+            help="Scheme and host of activation links, e.g. https://example.com",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            default=None,
+            help="File format, guessed from file extension by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of users created at once.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or path.rsplit(".", 1)[-1].lower()
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Unknown file format, use --format option.")
+
+        created, skipped, failed = 0, 0, 0
+        start = time.monotonic()
+
+        with open(path, newline="", encoding="utf-8") as f:
+            if file_format == "csv":
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip())
+
+            for batch_created, batch_skipped, batch_failed in services.import_users(
+                rows, options["base_url"], options["batch_size"], options["database"]
+            ):
+                created += batch_created
+                skipped += batch_skipped
+                failed += batch_failed
+
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f"Created {created} users, skipped {skipped} "
+                    f"({created / elapsed if elapsed else 0:.0f} users/s)."
+                )
+
+        if failed:
+            self.stderr.write(f"{failed} activation emails could not be sent.")
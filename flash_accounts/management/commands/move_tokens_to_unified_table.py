@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flash_accounts.models import ActivationToken, PasswordResetToken
+from flash_accounts.tokens import get_token_backend, UnifiedTokenBackend
+from flash_accounts import services
+
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Move activation and password reset tokens into the unified token "
+        "table in chunks, after switching to UnifiedTokenBackend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of tokens moved in a single transaction.",
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Stop after that many seconds, the next run continues.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        # tokens issued by per-kind backend after the move would be lost
+        if not isinstance(get_token_backend(), UnifiedTokenBackend):
+            raise CommandError(
+                "Set TOKEN_BACKEND to UnifiedTokenBackend before moving tokens."
+            )
+
+        deadline = None
+        if options["max_seconds"] is not None:
+            deadline = time.monotonic() + options["max_seconds"]
+
+        for token_class in (ActivationToken, PasswordResetToken):
+            moved = 0
+            start = time.monotonic()
+            while deadline is None or time.monotonic() < deadline:
+                chunk = services.move_tokens_to_unified_table(
+                    token_class, options["chunk_size"], options["database"]
+                )
+                moved += chunk
+                if chunk < options["chunk_size"]:
+                    break
+
+            elapsed = time.monotonic() - start
+            rate = moved / elapsed if elapsed else 0
+            self.stdout.write(
+                f"Moved {moved} {token_class.__name__} rows ({rate:.0f} rows/s)."
+            )
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+
+from flash_accounts.models import ActivationToken, PasswordResetToken, Token, TokenKind
+from flash_accounts.routers import get_write_database
+from flash_accounts import services
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Delete expired activation and password reset tokens in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of tokens deleted by a single statement.",
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Stop after that many seconds, the next run continues.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count expired tokens, do not delete them.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def get_targets(self):
+        """
+        Returns `(name, token class, filters)` tuples of purged token sets.
+        Unified token table is purged kind by kind.
+        """
+
+        targets = [
+            (ActivationToken.__name__, ActivationToken, {}),
+            (PasswordResetToken.__name__, PasswordResetToken, {}),
+        ]
+        for kind in TokenKind:
+            targets.append((f"{Token.__name__} ({kind})", Token, {"kind": kind}))
+        return targets
+
+    def handle(self, *args, **options):
+        deadline = None
+        if options["max_seconds"] is not None:
+            deadline = time.monotonic() + options["max_seconds"]
+
+        using = options["database"] or get_write_database()
+        for name, token_class, filters in self.get_targets():
+            if options["dry_run"]:
+                count = services.get_expired_tokens(
+                    token_class, using, **filters
+                ).count()
+                self.stdout.write(f"Would delete {count} expired {name} rows.")
+                continue
+
+            deleted = 0
+            start = time.monotonic()
+            while deadline is None or time.monotonic() < deadline:
+                chunk = services.delete_expired_tokens(
+                    token_class, options["chunk_size"], using, **filters
+                )
+                deleted += chunk
+                if chunk < options["chunk_size"]:
+                    break
+
+            elapsed = time.monotonic() - start
+            rate = deleted / elapsed if elapsed else 0
+            self.stdout.write(
+                f"Deleted {deleted} expired {name} rows ({rate:.0f} rows/s)."
+            )
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from flash_accounts.routers import get_write_database
+from flash_accounts.settings import flash_settings
+from flash_accounts import services
+
+import contextlib
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete inactive users in chunks, whose activation token expired "
+        "more than a grace period ago, optionally archiving them first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=None,
+            help="Grace period in hours, UNACTIVATED_USER_GRACE_PERIOD by default.",
+        )
+        parser.add_argument(
+            "--archive",
+            default=None,
+            help="Path of JSONL file deleted users are appended to.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of users deleted in a single transaction.",
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=None,
+            help="Stop after that many seconds, the next run continues.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count users to delete, do not delete them.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        if not flash_settings.ACTIVATE_ACCOUNT:
+            raise CommandError("Account activation is disabled.")
+
+        grace_period = flash_settings.UNACTIVATED_USER_GRACE_PERIOD
+        if options["grace_hours"] is not None:
+            grace_period = timezone.timedelta(hours=options["grace_hours"])
+        cutoff = timezone.now() - grace_period
+        using = options["database"] or get_write_database()
+
+        try:
+            if options["dry_run"]:
+                expired, tokenless = services.get_unactivated_users(cutoff, using)
+                count = expired.count()
+                if tokenless is not None:
+                    count += tokenless.count()
+                self.stdout.write(f"Would delete {count} unactivated users.")
+                return
+
+            self.reap(cutoff, options, using)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        except OSError as e:
+            raise CommandError(f"Cannot write archive: {e}")
+
+    def reap(self, cutoff, options, using):
+        deadline = None
+        if options["max_seconds"] is not None:
+            deadline = time.monotonic() + options["max_seconds"]
+
+        deleted = 0
+        start = time.monotonic()
+        with contextlib.ExitStack() as stack:
+            archive = None
+            if options["archive"] is not None:
+                archive = stack.enter_context(
+                    open(options["archive"], "a", encoding="utf-8")
+                )
+
+            while deadline is None or time.monotonic() < deadline:
+                chunk = services.reap_unactivated_users(
+                    cutoff, options["chunk_size"], archive, using
+                )
+                deleted += chunk
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f"Deleted {deleted} unactivated users "
+                    f"({deleted / elapsed if elapsed else 0:.0f} users/s)."
+                )
+                if chunk < options["chunk_size"]:
+                    break
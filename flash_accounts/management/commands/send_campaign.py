@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from flash_accounts.models import TokenKind
+from flash_accounts.routers import get_read_database
+from flash_accounts import services
+
+import time
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Send email rendered from a template to many users, "
+        "optionally with activation or password reset links."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "template_name",
+            help="Template path without extension, .txt and .html are used.",
+        )
+        parser.add_argument("--subject", required=True, help="Email subject.")
+        parser.add_argument(
+            "--base-url",
+            required=True,
+            help="Scheme and host of links, e.g. https://example.com",
+        )
+        parser.add_argument(
+            "--token",
+            choices=TokenKind.values,
+            default=None,
+            help="Issue tokens of that kind and link to their pages.",
+        )
+        parser.add_argument(
+            "--users",
+            choices=["all", "active", "inactive"],
+            default="all",
+            help="Users receiving the email, all by default.",
+        )
+        parser.add_argument(
+            "--context",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            help="Template variable shared by all emails, can be repeated.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of emails rendered and sent at once.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        context = {}
+        for item in options["context"]:
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise CommandError(f"Invalid context variable: {item}")
+            context[key] = value
+
+        users = User.objects.using(options["database"] or get_read_database())
+        if options["users"] != "all":
+            users = users.filter(is_active=options["users"] == "active")
+        users = users.order_by("pk").iterator(chunk_size=options["batch_size"] or 2000)
+
+        token_class_name = None
+        if options["token"] is not None:
+            token_class_name = services.TOKEN_CLASSES[options["token"]]
+
+        sent, failed = 0, 0
+        start = time.monotonic()
+        for batch_sent, batch_failed in services.send_campaign(
+            users,
+            options["template_name"],
+            options["subject"],
+            options["base_url"],
+            token_class_name=token_class_name,
+            get_context=lambda user: context,
+            batch_size=options["batch_size"],
+            using=options["database"],
+        ):
+            sent += batch_sent
+            failed += batch_failed
+
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"Sent {sent} emails, {failed} failed "
+                f"({(sent + failed) / elapsed if elapsed else 0:.0f} messages/s)."
+            )
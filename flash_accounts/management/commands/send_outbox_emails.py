@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from flash_accounts import services
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Send emails waiting in the Flash Accounts outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of emails claimed at once.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting when it is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls when the outbox is empty.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="Database alias, PRIMARY_DATABASE setting by default.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = services.send_outbox_emails(
+                options["batch_size"], options["database"]
+            )
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} emails, {failed} failed.")
+                continue
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
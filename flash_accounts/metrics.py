@@ -0,0 +1,172 @@
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from .settings import flash_settings
+
+from contextlib import nullcontext
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+
+class NullMetrics:
+    """
+    Default metrics backend, which ignores everything.
+    """
+
+    timer_context = nullcontext()
+
+    def timer(self, stage):
+        return self.timer_context
+
+    def observe(self, stage, seconds):
+        pass
+
+    def increment(self, event, value=1):
+        pass
+
+    def render_prometheus(self):
+        return ""
+
+
+class Timer:
+    """
+    Context manager reporting its duration to metrics backend.
+    """
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class HistogramMetrics:
+    """
+    Aggregates stage durations into histograms and counts events in memory
+    of the current process.
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # stage: [bucket counts..., +Inf count]
+        self.histograms = {}
+        self.sums = {}
+        self.counters = {}
+
+    def timer(self, stage):
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = [0] * (len(self.buckets) + 1)
+                self.sums[stage] = 0.0
+            self.histograms[stage][index] += 1
+            self.sums[stage] += seconds
+
+    def increment(self, event, value=1):
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+
+    def render_prometheus(self):
+        """
+        Returns aggregated metrics in Prometheus text format.
+        """
+
+        lines = []
+        with self.lock:
+            if self.histograms:
+                lines.append("# TYPE flash_accounts_stage_seconds histogram")
+            for stage, counts in sorted(self.histograms.items()):
+                cumulative = 0
+                for bucket, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(
+                        f'flash_accounts_stage_seconds_bucket{{stage="{stage}",'
+                        f'le="{bucket}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'flash_accounts_stage_seconds_sum{{stage="{stage}"}} '
+                    f"{self.sums[stage]}"
+                )
+                lines.append(
+                    f'flash_accounts_stage_seconds_count{{stage="{stage}"}} '
+                    f"{cumulative}"
+                )
+
+            if self.counters:
+                lines.append("# TYPE flash_accounts_events_total counter")
+            for event, value in sorted(self.counters.items()):
+                lines.append(f'flash_accounts_events_total{{event="{event}"}} {value}')
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+_metrics = None
+
+
+def get_metrics():
+    """
+    Returns instance of metrics backend declared in `METRICS_BACKEND` setting.
+    """
+
+    global _metrics
+    if _metrics is None:
+        _metrics = import_string(flash_settings.METRICS_BACKEND)()
+    return _metrics
+
+
+def timer(stage):
+    """
+    Returns context manager measuring duration of given stage.
+    """
+
+    return get_metrics().timer(stage)
+
+
+def timed(stage):
+    """
+    Decorator measuring duration of decorated function.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(event, value=1):
+    """
+    Increase counter of given event.
+    """
+
+    get_metrics().increment(event, value)
+
+
+def reset_metrics(*args, **kwargs):
+    """
+    Load metrics backend again if user changed app settings.
+    """
+
+    global _metrics
+    if kwargs["setting"] == "FLASH_SETTINGS":
+        _metrics = None
+
+
+# signal
+setting_changed.connect(reset_metrics)
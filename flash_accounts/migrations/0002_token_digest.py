@@ -0,0 +1,68 @@
+import hashlib
+
+from django.db import migrations, models
+
+# number of tokens read and updated at once
+BATCH_SIZE = 1000
+
+
+def hash_existing_tokens(apps, schema_editor):
+    """
+    Replace stored raw tokens with their digests in batches,
+    so already sent links stay valid.
+    """
+
+    db_alias = schema_editor.connection.alias
+    for model_name in ("ActivationToken", "PasswordResetToken"):
+        model = apps.get_model("flash_accounts", model_name)
+        tokens = model.objects.using(db_alias)
+        batch = []
+        rows = (
+            tokens.exclude(token="").only("pk", "token").iterator(chunk_size=BATCH_SIZE)
+        )
+        for token in rows:
+            token.digest = hashlib.sha256(token.token.encode()).hexdigest()
+            batch.append(token)
+            if len(batch) == BATCH_SIZE:
+                tokens.bulk_update(batch, ["digest"])
+                batch = []
+        tokens.bulk_update(batch, ["digest"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flash_accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activationtoken",
+            name="digest",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="passwordresettoken",
+            name="digest",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_existing_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="activationtoken",
+            name="digest",
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="passwordresettoken",
+            name="digest",
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.RemoveField(
+            model_name="activationtoken",
+            name="token",
+        ),
+        migrations.RemoveField(
+            model_name="passwordresettoken",
+            name="token",
+        ),
+    ]
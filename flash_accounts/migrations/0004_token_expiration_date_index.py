@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flash_accounts", "0003_outboxemail"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="activationtoken",
+            name="expiration_date",
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="passwordresettoken",
+            name="expiration_date",
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# number of users indexed at once
+BATCH_SIZE = 1000
+
+
+def index_existing_users(apps, schema_editor):
+    """
+    Index emails of existing users in primary key batches, so they can
+    be found by email right after upgrading.
+    """
+
+    db_alias = schema_editor.connection.alias
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    EmailIndex = apps.get_model("flash_accounts", "EmailIndex")
+    users = User.objects.using(db_alias).order_by("pk").values_list("pk", "email")
+
+    last_pk = None
+    while True:
+        batch = users if last_pk is None else users.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        EmailIndex.objects.using(db_alias).bulk_create(
+            EmailIndex(user_id=pk, email=(email or "").strip().lower())
+            for pk, email in batch
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("flash_accounts", "0004_token_expiration_date_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailIndex",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="email_index",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("email", models.CharField(db_index=True, max_length=254)),
+            ],
+        ),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
@@ -1,30 +1,70 @@
+from django.core.mail import EmailMultiAlternatives
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.db import models
 
-from random import choice
-import string
+import hashlib
 
+from .generators import get_token_generator
 from .settings import flash_settings
 
 
 User = get_user_model()
 
 
+class TokenKind(models.TextChoices):
+    """
+    Kinds of tokens, each with its own lifetime setting.
+    """
+
+    ACTIVATION = "activation", "Activation"
+    PASSWORD_RESET = "password_reset", "Password reset"
+
+
+# names of settings declaring lifetimes of token kinds
+TOKEN_LIFETIME_SETTINGS = {
+    TokenKind.ACTIVATION: "ACTIVATION_TOKEN_LIFETIME",
+    TokenKind.PASSWORD_RESET: "PASSWORD_RESET_TOKEN_LIFETIME",
+}
+
+
+def get_token_lifetime(kind):
+    """
+    Returns lifetime of given kind tokens.
+    """
+
+    return getattr(flash_settings, TOKEN_LIFETIME_SETTINGS[kind])
+
+
 class BaseToken(models.Model):
     """
     Base class which token classes inherits from.
+
+    Only a SHA-256 digest of the token is stored in the database.
+    The raw value is available in `token` attribute right after
+    generating it, so it can be sent to the user.
     """
 
-    token = models.CharField(max_length=55)
-    expiration_date = models.DateTimeField(null=True)
+    digest = models.CharField(max_length=64, unique=True, null=True)
+    expiration_date = models.DateTimeField(null=True, db_index=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateField(auto_now=True)
 
+    # raw token value, never saved to the database
+    token = ""
+
     class Meta:
         abstract = True
 
+    @staticmethod
+    def hash_token(token_value):
+        """
+        Returns hex SHA-256 digest of given token value.
+        """
+
+        return hashlib.sha256(token_value.encode()).hexdigest()
+
     @property
     def expired(self):
         """
@@ -35,24 +75,30 @@ class BaseToken(models.Model):
 
     def generate_token(self):
         """
-        Generates random, 55 characters long string.
+        Generates random string with the configured token generator
+        and stores its digest.
         """
 
-        characters = string.ascii_letters + string.digits
-        self.token = "".join(choice(characters) for _ in range(55))
+        self.token = get_token_generator().generate()
+        self.digest = self.hash_token(self.token)
 
     def set_expiration_date(self):
         """
         Sets the expiration date for adequate token.
         """
 
-        if self.__class__.__name__ == ActivationToken.__name__:
-            token_lifetime = flash_settings.ACTIVATION_TOKEN_LIFETIME
+        self.expiration_date = get_token_lifetime(self.kind) + timezone.now()
 
-        elif self.__class__.__name__ == PasswordResetToken.__name__:
-            token_lifetime = flash_settings.PASSWORD_RESET_TOKEN_LIFETIME
+    def issued_within(self, period):
+        """
+        Returns `True` if token was issued less than `period` ago.
+        Issue time is derived from expiration date and token lifetime.
+        """
 
-        self.expiration_date = token_lifetime + timezone.now()
+        if self.expiration_date is None:
+            return False
+        issued_at = self.expiration_date - get_token_lifetime(self.kind)
+        return issued_at > timezone.now() - period
 
     def set_up_token(self):
         """
@@ -68,6 +114,8 @@ class ActivationToken(BaseToken):
     Token for account activation feature.
     """
 
+    kind = TokenKind.ACTIVATION
+
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name="activation_token"
     )
@@ -78,6 +126,125 @@ class PasswordResetToken(BaseToken):
     Token for password reset feature.
     """
 
+    kind = TokenKind.PASSWORD_RESET
+
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name="password_reset_token"
     )
+
+
+class Token(BaseToken):
+    """
+    Token of any kind, stored in a single table by `UnifiedTokenBackend`.
+
+    A user has at most one token of each kind. Lookups by digest
+    and expiry are served by composite indexes starting with `kind`.
+    """
+
+    kind = models.CharField(max_length=32, choices=TokenKind.choices)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tokens")
+
+    # indexed together with kind
+    digest = models.CharField(max_length=64, null=True)
+    expiration_date = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "user"], name="flash_token_kind_user_uniq"
+            ),
+            models.UniqueConstraint(
+                fields=["kind", "digest"], name="flash_token_kind_digest_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["kind", "expiration_date"], name="flash_token_kind_expiry_idx"
+            ),
+        ]
+
+
+class EmailIndex(models.Model):
+    """
+    Normalized email address of a user, kept in sync by signals.
+
+    Allows indexed, case-insensitive email lookups on user tables,
+    which cannot be altered to add an index on email column.
+    Writes bypassing `post_save` signal, e.g. `QuerySet.update`,
+    must be followed by `backfill_email_index` command.
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="email_index", primary_key=True
+    )
+    email = models.CharField(max_length=254, db_index=True)
+
+    @staticmethod
+    def normalize(email):
+        """
+        Returns email address used for lookups.
+        """
+
+        return email.strip().lower()
+
+
+class OutboxEmail(models.Model):
+    """
+    Email waiting to be sent by the outbox worker.
+    """
+
+    to_email = models.EmailField()
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    text_content = models.TextField()
+    html_content = models.TextField(blank=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["sent_at", "next_attempt_at"],
+                name="flash_outbox_pending_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Returns unsaved outbox email built from `EmailMultiAlternatives`.
+        """
+
+        html_content = ""
+        for content, mimetype in message.alternatives:
+            if mimetype == "text/html":
+                html_content = content
+
+        return cls(
+            to_email=message.to[0],
+            from_email=message.from_email,
+            subject=message.subject,
+            text_content=message.body,
+            html_content=html_content,
+        )
+
+    def build_message(self, connection=None):
+        """
+        Returns `EmailMultiAlternatives` ready to be sent.
+        """
+
+        msg = EmailMultiAlternatives(
+            self.subject,
+            self.text_content,
+            self.from_email,
+            [self.to_email],
+            connection=connection,
+        )
+        if self.html_content:
+            msg.attach_alternative(self.html_content, "text/html")
+        return msg
@@ -0,0 +1,53 @@
+from django.conf import settings
+
+from .settings import flash_settings
+
+
+def get_write_database():
+    """
+    Returns alias of database for writes and reads which must follow them.
+    """
+
+    return flash_settings.PRIMARY_DATABASE
+
+
+def get_read_database():
+    """
+    Returns alias of database for read-only checks,
+    replica if it is configured.
+    """
+
+    return flash_settings.REPLICA_DATABASE or flash_settings.PRIMARY_DATABASE
+
+
+class PrimaryReplicaRouter:
+    """
+    Database router for deployments with a read replica.
+
+    Sends queries of Flash Accounts models and writes of user model
+    to `PRIMARY_DATABASE`, also for instances read from replica,
+    and allows relations between instances of both databases.
+    Services read from `REPLICA_DATABASE` explicitly with `using`.
+    """
+
+    def is_app_model(self, model):
+        return model._meta.app_label == "flash_accounts"
+
+    def is_user_model(self, model):
+        return model._meta.label == settings.AUTH_USER_MODEL
+
+    def db_for_read(self, model, **hints):
+        if self.is_app_model(model):
+            return get_write_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if self.is_app_model(model) or self.is_user_model(model):
+            return get_write_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {get_write_database(), get_read_database()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -1,25 +1,51 @@
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
 
-from rest_framework.validators import UniqueValidator, ValidationError
+from rest_framework.validators import ValidationError
 from rest_framework import serializers
 
+from .models import EmailIndex, TokenKind
+from . import metrics
+
 
 User = get_user_model()
 
 
+def timed_validate_password(value):
+    """
+    `validate_password` reporting its duration to metrics backend.
+    """
+
+    with metrics.timer("password_validation"):
+        validate_password(value)
+
+
+class UniqueEmailValidator:
+    """
+    Checks that no user has given email address, compared case-insensitively
+    using the email index. Reports its duration to metrics backend.
+    """
+
+    message = "user with this email address already exists."
+
+    def __call__(self, value):
+        with metrics.timer("unique_check"):
+            taken = EmailIndex.objects.filter(
+                email=EmailIndex.normalize(value)
+            ).exists()
+        if taken:
+            raise ValidationError(self.message, code="unique")
+
+
 class UserCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for account creation.
     Checks for email uniqueness and requires to repeat password.
     """
 
-    email = serializers.EmailField(
-        required=True,
-        validators=[UniqueValidator(queryset=User.objects.all())],
-    )
+    email = serializers.EmailField(required=True, validators=[UniqueEmailValidator()])
     password = serializers.CharField(
-        write_only=True, required=True, validators=[validate_password]
+        write_only=True, required=True, validators=[timed_validate_password]
     )
     password2 = serializers.CharField(write_only=True, required=True)
 
@@ -37,6 +63,19 @@ class UserCreateSerializer(serializers.ModelSerializer):
         attrs.pop("password2")
         return attrs
 
+    def create(self, validated_data):
+        """
+        Hash password before user is saved, so user is inserted once.
+        """
+
+        password = validated_data.pop("password")
+        user = User(**validated_data)
+        with metrics.timer("password_hash"):
+            user.set_password(password)
+        with metrics.timer("user_write"):
+            user.save()
+        return user
+
 
 class EmailSerializer(serializers.Serializer):
     """
@@ -52,7 +91,7 @@ class PasswordResetSerializer(serializers.Serializer):
     """
 
     password = serializers.CharField(
-        write_only=True, required=True, validators=[validate_password]
+        write_only=True, required=True, validators=[timed_validate_password]
     )
     password2 = serializers.CharField(write_only=True, required=True)
 
@@ -65,3 +104,16 @@ class PasswordResetSerializer(serializers.Serializer):
             raise ValidationError({"password": "Provided passwords does not match."})
         attrs.pop("password2")
         return attrs
+
+
+class TokenExportSerializer(serializers.Serializer):
+    """
+    Serializer for query parameters of token export.
+    """
+
+    kind = serializers.ChoiceField(choices=TokenKind.choices)
+    file_format = serializers.ChoiceField(choices=["csv", "jsonl"], default="csv")
+    expires_after = serializers.DateTimeField(required=False)
+    expires_before = serializers.DateTimeField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
@@ -1,23 +1,237 @@
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.db.models import Q, F, Exists, OuterRef
+from django.db import transaction
+from django.utils import timezone
 from django.urls import reverse
 
-from .models import ActivationToken, PasswordResetToken
+from asgiref.sync import sync_to_async
+
+from .models import (
+    ActivationToken,
+    PasswordResetToken,
+    OutboxEmail,
+    EmailIndex,
+    TokenKind,
+    Token,
+)
+from .routers import get_read_database, get_write_database
+from .tokens import get_token_backend, ModelTokenBackend
+from .token_cache import token_cache
+from .mail_templates import email_templates
 from .settings import flash_settings
+from . import metrics
+
+from contextlib import nullcontext
+from itertools import islice
+from urllib.parse import urlsplit
+from datetime import date
+import json
+import csv
 
 
 User = get_user_model()
 
+# token classes of token kinds
+TOKEN_CLASSES = {
+    TokenKind.ACTIVATION: ActivationToken,
+    TokenKind.PASSWORD_RESET: PasswordResetToken,
+}
+
+# url names, template and subject settings of emails with tokens
+TOKEN_EMAILS = {
+    ActivationToken: (
+        "activate",
+        "ACTIVATION_EMAIL_TEMPLATE",
+        "ACTIVATION_EMAIL_SUBJECT",
+    ),
+    PasswordResetToken: (
+        "password_reset_confirm",
+        "PASSWORD_RESET_EMAIL_TEMPLATE",
+        "PASSWORD_RESET_EMAIL_SUBJECT",
+    ),
+}
+
+
+def create_user(serializer, request, using=None):
+    """
+    Save user from validated `UserCreateSerializer`, its email index row
+    is saved in the same transaction.
+    With account activation enabled, user is saved as inactive
+    and activation token is created in the same transaction,
+    activation email is sent once it is committed.
+
+    User is saved to the database chosen by routers, which should be
+    the one passed with `using`, `PRIMARY_DATABASE` by default.
+    """
+    using = using or get_write_database()
+    msg = None
+    with transaction.atomic(using=using):
+        # Account activation
+        if flash_settings.ACTIVATE_ACCOUNT:
+            user = serializer.save(is_active=False)
+            msg = create_token_mail(
+                ActivationToken, user, request, new_user=True, using=using
+            )
+        else:
+            user = serializer.save()
+    send_mail(msg)
+    return user
+
 
-def create_and_send_activation_token(user, request):
+def create_and_send_activation_token(user, request, new_user=False, using=None):
     """
     Generate email activation token and send email with activation link.
+    Pass `new_user=True` for just created user, who cannot have a token yet.
+
+    Repeated request within `TOKEN_REISSUE_COOLDOWN` keeps token issued
+    by the previous one and sends no email.
+    """
+    send_mail(create_token_mail(ActivationToken, user, request, new_user, using))
+
+
+def create_and_send_password_reset_token(user, request, using=None):
+    """
+    Generate password reset token and send email with instructions.
+
+    Repeated request within `TOKEN_REISSUE_COOLDOWN` keeps token issued
+    by the previous one and sends no email.
+    """
+    send_mail(create_token_mail(PasswordResetToken, user, request, using=using))
+
+
+def create_token_mail(token_class_name, user, request, new_user=False, using=None):
+    """
+    Generate token of given class and build email with link using it.
+    Pass `new_user=True` for just created user, who cannot have a token yet.
+
+    With `EMAIL_OUTBOX` setting enabled, email is stored in the outbox
+    in the same transaction as the token and `None` is returned.
+    Otherwise email is returned, to be sent with `send_mail` once
+    the transaction is over, so no locks are held during SMTP round trip.
+
+    Repeated request within `TOKEN_REISSUE_COOLDOWN` keeps token issued
+    by the previous one and `None` is returned.
+    """
+    using = using or get_write_database()
+    url_name, template_setting, subject_setting = TOKEN_EMAILS[token_class_name]
+
+    atomic = nullcontext()
+    if flash_settings.EMAIL_OUTBOX:
+        # no savepoint within transaction of `create_user`
+        atomic = transaction.atomic(using=using, savepoint=False)
+
+    with atomic:
+        with metrics.timer("token_write"):
+            token = get_token_backend().create_token(
+                token_class_name,
+                user,
+                new_user,
+                using=using,
+                cooldown=flash_settings.TOKEN_REISSUE_COOLDOWN,
+            )
+        if token is None:
+            metrics.increment("token_reissue_coalesced")
+            return None
+
+        msg = build_mail_with_token(
+            to_email=user.email,
+            username=user.username,
+            url=build_url(request, url_name, token),
+            host=request.get_host(),
+            template_name=getattr(flash_settings, template_setting),
+            subject=getattr(flash_settings, subject_setting),
+        )
+        if not flash_settings.EMAIL_OUTBOX:
+            return msg
+
+        with metrics.timer("email_send"):
+            OutboxEmail.from_message(msg).save(using=using)
+        metrics.increment("email_queued")
+        return None
+
+
+def send_mail(msg):
+    """
+    Send email built by `create_token_mail`, if there is one.
+    """
+    if msg is None:
+        return
+
+    with metrics.timer("email_send"):
+        msg.send()
+    metrics.increment("email_sent")
+
+
+def activate_account_with_token(token_value, using=None):
+    """
+    Consume activation token and activate its user.
+    Unknown tokens are found out on replica, if it is configured.
+    """
+    with metrics.timer("token_consume"):
+        return get_token_backend().consume_token(
+            ActivationToken, token_value, using=using, is_active=True
+        )
+
+
+def reset_password_with_token(token_value, new_password, using=None):
+    """
+    Consume password reset token and set new password for its user.
+    Unknown tokens are found out on replica, if it is configured.
+
+    Token is validated before the password is hashed, so invalid
+    tokens cost no hashing.
+    """
+    backend = get_token_backend()
+    token = backend.validate_token(PasswordResetToken, token_value, using)
+    with metrics.timer("password_hash"):
+        password = make_password(new_password)
+    with metrics.timer("token_consume"):
+        return backend.consume_token(
+            PasswordResetToken,
+            token_value,
+            using=using,
+            validated=token,
+            password=password,
+        )
+
+
+async def acreate_user(serializer, request, using=None):
+    """
+    Async version of `create_user`.
+    User and activation token are saved in one transaction,
+    which requires running it in a thread.
+    """
+    return await sync_to_async(create_user)(serializer, request, using)
+
+
+async def acreate_and_send_activation_token(user, request, new_user=False, using=None):
+    """
+    Async version of `create_and_send_activation_token`.
     """
-    token = create_adequate_token(ActivationToken, user)
-    url = build_url(request, "activate", token.token)
+    if flash_settings.EMAIL_OUTBOX:
+        # token and outbox email are saved in one transaction
+        return await sync_to_async(create_and_send_activation_token)(
+            user, request, new_user, using
+        )
 
-    send_mail_with_token(
+    token = await get_token_backend().acreate_token(
+        ActivationToken,
+        user,
+        new_user,
+        using=using,
+        cooldown=flash_settings.TOKEN_REISSUE_COOLDOWN,
+    )
+    if token is None:
+        metrics.increment("token_reissue_coalesced")
+        return
+    url = build_url(request, "activate", token)
+
+    await asend_mail_with_token(
         to_email=user.email,
         username=user.username,
         url=url,
@@ -27,14 +241,28 @@ def create_and_send_activation_token(user, request):
     )
 
 
-def create_and_send_password_reset_token(user, request):
+async def acreate_and_send_password_reset_token(user, request, using=None):
     """
-    Generate password reset token and send email with instructions.
+    Async version of `create_and_send_password_reset_token`.
     """
-    token = create_adequate_token(PasswordResetToken, user)
-    url = build_url(request, "password_reset_confirm", token.token)
+    if flash_settings.EMAIL_OUTBOX:
+        # token and outbox email are saved in one transaction
+        return await sync_to_async(create_and_send_password_reset_token)(
+            user, request, using
+        )
+
+    token = await get_token_backend().acreate_token(
+        PasswordResetToken,
+        user,
+        using=using,
+        cooldown=flash_settings.TOKEN_REISSUE_COOLDOWN,
+    )
+    if token is None:
+        metrics.increment("token_reissue_coalesced")
+        return
+    url = build_url(request, "password_reset_confirm", token)
 
-    send_mail_with_token(
+    await asend_mail_with_token(
         to_email=user.email,
         username=user.username,
         url=url,
@@ -44,14 +272,176 @@ def create_and_send_password_reset_token(user, request):
     )
 
 
-def create_adequate_token(token_class_name, user):
+async def aactivate_account_with_token(token_value, using=None):
+    """
+    Async version of `activate_account_with_token`.
+    """
+    return await get_token_backend().aconsume_token(
+        ActivationToken, token_value, using=using, is_active=True
+    )
+
+
+async def areset_password_with_token(token_value, new_password, using=None):
+    """
+    Async version of `reset_password_with_token`.
+    Password is hashed in a thread, so event loop is not blocked.
+    """
+    backend = get_token_backend()
+    token = await backend.avalidate_token(PasswordResetToken, token_value, using)
+    password = await sync_to_async(make_password, thread_sensitive=False)(new_password)
+    return await backend.aconsume_token(
+        PasswordResetToken,
+        token_value,
+        using=using,
+        validated=token,
+        password=password,
+    )
+
+
+def get_user_by_email(email, using=None):
+    """
+    Returns user with given email address, looked up case-insensitively
+    in the email index, or `None` if there is no such user.
+    It is a read-only check, so it goes to replica, if it is configured,
+    unless other database alias is passed with `using`.
+    """
+    return (
+        User.objects.using(using or get_read_database())
+        .filter(email_index__email=EmailIndex.normalize(email))
+        .first()
+    )
+
+
+async def aget_user_by_email(email, using=None):
+    """
+    Async version of `get_user_by_email`.
+    """
+    return await (
+        User.objects.using(using or get_read_database())
+        .filter(email_index__email=EmailIndex.normalize(email))
+        .afirst()
+    )
+
+
+def backfill_email_index(after_pk, chunk_size, using=None):
+    """
+    Index emails of at most `chunk_size` users with primary keys greater
+    than `after_pk`. Missing and outdated index rows are written in bulk.
+
+    Returns a `(last_pk, written)` tuple, `last_pk` is `None`
+    if there are no more users.
+    """
+    using = using or get_write_database()
+    users = list(
+        User.objects.using(using)
+        .filter(pk__gt=after_pk)
+        .order_by("pk")
+        .values_list("pk", "email")[:chunk_size]
+    )
+    if not users:
+        return None, 0
+
+    indexed = dict(
+        EmailIndex.objects.using(using)
+        .filter(user_id__in=[pk for pk, _ in users])
+        .values_list("user_id", "email")
+    )
+    missing, outdated = [], []
+    for pk, email in users:
+        row = EmailIndex(user_id=pk, email=EmailIndex.normalize(email))
+        if pk not in indexed:
+            missing.append(row)
+        elif indexed[pk] != row.email:
+            outdated.append(row)
+
+    with transaction.atomic(using=using):
+        EmailIndex.objects.using(using).bulk_create(missing)
+        EmailIndex.objects.using(using).bulk_update(outdated, ["email"])
+
+    return users[-1][0], len(missing) + len(outdated)
+
+
+def get_expired_tokens(token_class_name, using=None, **filters):
+    """
+    Returns queryset of expired tokens of given class. Pass `kind` filter
+    for `Token` class, so expiry lookup is served by `(kind, expiration_date)`
+    index.
+
+    With account activation enabled, activation tokens of users who never
+    activated their accounts are left out. `reap_unactivated_users` finds
+    such users by them and deletes them together with their tokens.
+    """
+    tokens = token_class_name.objects.using(using or get_write_database()).filter(
+        expiration_date__lt=timezone.now(), **filters
+    )
+    kind = filters.get("kind", token_class_name.kind)
+    if kind == TokenKind.ACTIVATION and flash_settings.ACTIVATE_ACCOUNT:
+        tokens = tokens.exclude(user__is_active=False, user__last_login__isnull=True)
+    return tokens
+
+
+def delete_expired_tokens(token_class_name, chunk_size, using=None, **filters):
+    """
+    Delete at most `chunk_size` tokens of given class returned by
+    `get_expired_tokens`, the lowest primary keys first.
+    Returns the number of deleted tokens.
+    """
+    tokens = token_class_name.objects.using(using or get_write_database())
+    pks = list(
+        get_expired_tokens(token_class_name, using, **filters)
+        .order_by("pk")
+        .values_list("pk", flat=True)[:chunk_size]
+    )
+    if not pks:
+        return 0
+
+    deleted, _ = tokens.filter(pk__in=pks).delete()
+    return deleted
+
+
+def move_tokens_to_unified_table(token_class_name, chunk_size, using=None):
     """
-    Create and set-up given class name token.
+    Move at most `chunk_size` tokens of given class into the unified
+    `Token` table, the lowest primary keys first, so links sent before
+    switching to `UnifiedTokenBackend` stay valid. Moved rows are deleted
+    from per-kind table in the same transaction.
+
+    Tokens of users, who already got a token from `UnifiedTokenBackend`,
+    are dropped, as the newer token replaces them.
+    Returns the number of moved tokens.
     """
-    token, _ = token_class_name.objects.get_or_create(user=user)
-    token.set_up_token()
-    token.save()
-    return token
+    using = using or get_write_database()
+    with transaction.atomic(using=using):
+        rows = list(
+            token_class_name.objects.using(using)
+            .select_for_update()
+            .order_by("pk")
+            .values_list("pk", "user_id", "digest", "expiration_date")[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        Token.objects.using(using).bulk_create(
+            [
+                Token(
+                    kind=token_class_name.kind,
+                    user_id=user_id,
+                    digest=digest,
+                    expiration_date=expiration_date,
+                )
+                for _, user_id, digest, expiration_date in rows
+                if digest is not None
+            ],
+            ignore_conflicts=True,
+        )
+        token_class_name.objects.using(using).filter(
+            pk__in=[pk for pk, *_ in rows]
+        ).delete()
+
+    # lookups made before the move may have cached the token as missing
+    digests = [digest for _, _, digest, _ in rows if digest is not None]
+    token_cache.discard_many(token_class_name, digests, using)
+    return len(rows)
 
 
 def build_url(request, url_name: str, token: str):
@@ -63,9 +453,37 @@ def build_url(request, url_name: str, token: str):
     return url
 
 
-def send_mail_with_token(to_email, username, url, host, template_name, subject):
+def send_mail_with_token(
+    to_email, username, url, host, template_name, subject, using=None
+):
     """
     Build mail from template and send to the user.
+    When `EMAIL_OUTBOX` setting is enabled, mail is stored in the outbox
+    and sent later by `send_outbox_emails`.
+    """
+    msg = build_mail_with_token(to_email, username, url, host, template_name, subject)
+
+    with metrics.timer("email_send"):
+        if flash_settings.EMAIL_OUTBOX:
+            OutboxEmail.from_message(msg).save(using=using or get_write_database())
+            metrics.increment("email_queued")
+        else:
+            msg.send()
+            metrics.increment("email_sent")
+
+
+async def asend_mail_with_token(to_email, username, url, host, template_name, subject):
+    """
+    Async version of `send_mail_with_token`, without outbox support.
+    Mail is sent in a thread, so event loop is not blocked.
+    """
+    msg = build_mail_with_token(to_email, username, url, host, template_name, subject)
+    await sync_to_async(msg.send, thread_sensitive=False)()
+
+
+def build_mail_with_token(to_email, username, url, host, template_name, subject):
+    """
+    Build mail from template, without sending it.
     """
     from_email = flash_settings.EMAIL_FROM
 
@@ -75,9 +493,752 @@ def send_mail_with_token(to_email, username, url, host, template_name, subject):
         "host": host,
     }
 
-    html_content = render_to_string(f"{template_name}.html", context)
-    text_content = render_to_string(f"{template_name}.txt", context)
+    with metrics.timer("template_render"):
+        text_content, html_content = email_templates.render(template_name, context)
 
     msg = EmailMultiAlternatives(subject, text_content, from_email, [to_email])
     msg.attach_alternative(html_content, "text/html")
-    msg.send()
+    return msg
+
+
+def bulk_create_and_send_activation_tokens(users, request, batch_size=None, using=None):
+    """
+    Generate activation tokens for many users and send emails
+    in batches over a single connection.
+
+    Returns a list of `(user, error)` tuples, `error` is `None`
+    if email was sent. Users, whose tokens were reissued concurrently,
+    are left out.
+    """
+    return bulk_create_and_send_tokens(
+        ActivationToken,
+        users,
+        request,
+        url_name="activate",
+        template_name=flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+        subject=flash_settings.ACTIVATION_EMAIL_SUBJECT,
+        batch_size=batch_size,
+        using=using,
+    )
+
+
+def bulk_create_and_send_password_reset_tokens(
+    users, request, batch_size=None, using=None
+):
+    """
+    Generate password reset tokens for many users and send emails
+    in batches over a single connection.
+
+    Returns a list of `(user, error)` tuples, `error` is `None`
+    if email was sent. Users, whose tokens were reissued concurrently,
+    are left out.
+    """
+    return bulk_create_and_send_tokens(
+        PasswordResetToken,
+        users,
+        request,
+        url_name="password_reset_confirm",
+        template_name=flash_settings.PASSWORD_RESET_EMAIL_TEMPLATE,
+        subject=flash_settings.PASSWORD_RESET_EMAIL_SUBJECT,
+        batch_size=batch_size,
+        using=using,
+    )
+
+
+def bulk_create_and_send_tokens(
+    token_class_name,
+    users,
+    request,
+    url_name,
+    template_name,
+    subject,
+    batch_size,
+    using=None,
+):
+    """
+    Create tokens and send emails batch by batch.
+    Emails of every batch are stored in the outbox
+    if `EMAIL_OUTBOX` setting is enabled.
+    Users, whose tokens were reissued by concurrent requests, are skipped.
+    """
+    using = using or get_write_database()
+    batch_size = batch_size or flash_settings.EMAIL_BATCH_SIZE
+    token_backend = get_token_backend()
+    users = list(users)
+    results = []
+
+    # opened on first send and reused by all batches
+    connection = get_connection()
+    try:
+        for i in range(0, len(users), batch_size):
+            batch = users[i : i + batch_size]
+            recipients = []
+            messages = []
+
+            with transaction.atomic(using=using):
+                for user in batch:
+                    token = token_backend.create_token(
+                        token_class_name, user, using=using
+                    )
+                    if token is None:
+                        continue
+                    recipients.append(user)
+                    url = build_url(request, url_name, token)
+                    messages.append(
+                        build_mail_with_token(
+                            to_email=user.email,
+                            username=user.username,
+                            url=url,
+                            host=request.get_host(),
+                            template_name=template_name,
+                            subject=subject,
+                        )
+                    )
+
+                if flash_settings.EMAIL_OUTBOX:
+                    OutboxEmail.objects.using(using).bulk_create(
+                        OutboxEmail.from_message(msg) for msg in messages
+                    )
+
+            if flash_settings.EMAIL_OUTBOX:
+                results += [(user, None) for user in recipients]
+            else:
+                results += zip(recipients, send_messages(messages, connection))
+    finally:
+        connection.close()
+
+    return results
+
+
+def reissue_and_send_tokens(tokens, base_url, batch_size=None, using=None):
+    """
+    Reissue tokens of given `ActivationToken` or `PasswordResetToken`
+    queryset and send emails with new links starting with `base_url`
+    batch by batch.
+    Every batch is read by one query and written by one statement.
+    Emails are stored in the outbox if `EMAIL_OUTBOX` setting is enabled.
+    Activation tokens of already active users are skipped.
+
+    Returns a `(reissued, failed)` tuple.
+    """
+    using = using or get_write_database()
+    batch_size = batch_size or flash_settings.EMAIL_BATCH_SIZE
+    model = tokens.model
+    url_name, template_setting, subject_setting = TOKEN_EMAILS[model]
+    tokens = tokens.using(using).select_related("user").order_by("pk")
+    if model.kind == TokenKind.ACTIVATION:
+        tokens = tokens.filter(user__is_active=False)
+    base_url = base_url.rstrip("/")
+    host = urlsplit(base_url).netloc
+    reissued, failed = 0, 0
+    last_pk = None
+
+    # opened on first send and reused by all batches
+    connection = get_connection()
+    try:
+        while True:
+            batch = tokens if last_pk is None else tokens.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            digests = [token.digest for token in batch]
+            messages = []
+
+            with transaction.atomic(using=using):
+                for token in batch:
+                    token.set_up_token()
+                    token.updated_at = date.today()
+                    url = base_url
+                    url += reverse(url_name, kwargs={"token_value": token.token})
+                    messages.append(
+                        build_mail_with_token(
+                            to_email=token.user.email,
+                            username=token.user.username,
+                            url=url,
+                            host=host,
+                            template_name=getattr(flash_settings, template_setting),
+                            subject=getattr(flash_settings, subject_setting),
+                        )
+                    )
+                model.objects.using(using).bulk_update(
+                    batch, ["digest", "expiration_date", "updated_at"]
+                )
+                token_cache.invalidate_many(model, digests, using)
+
+                if flash_settings.EMAIL_OUTBOX:
+                    OutboxEmail.objects.using(using).bulk_create(
+                        OutboxEmail.from_message(msg) for msg in messages
+                    )
+
+            reissued += len(batch)
+            if not flash_settings.EMAIL_OUTBOX:
+                errors = send_messages(messages, connection)
+                failed += len([error for error in errors if error is not None])
+            if len(batch) < batch_size:
+                break
+    finally:
+        connection.close()
+
+    return reissued, failed
+
+
+def expire_tokens(tokens, using=None):
+    """
+    Expire tokens of given queryset by one statement,
+    so links sent with them stop working.
+    Returns the number of expired tokens.
+    """
+    using = using or get_write_database()
+    now = timezone.now()
+    tokens = tokens.using(using).filter(expiration_date__gt=now)
+
+    digests = []
+    if token_cache.enabled:
+        digests = list(tokens.values_list("digest", flat=True))
+    expired = tokens.update(expiration_date=now)
+    token_cache.discard_many(tokens.model, digests, using)
+    return expired
+
+
+def send_campaign(
+    users,
+    template_name,
+    subject,
+    base_url,
+    token_class_name=None,
+    get_context=None,
+    batch_size=None,
+    using=None,
+):
+    """
+    Send emails rendered from `template_name` to many users batch by batch,
+    e.g. activation reminders or security notices.
+
+    Templates are rendered once per distinct shared context, returned
+    by `get_context(user)` with hashable values, and `username`, `email`
+    and `url` of every user are substituted into them. With
+    `token_class_name` given, tokens of every batch are issued in bulk
+    and `url` links to the token page under `base_url`, otherwise
+    `url` is `base_url`. Emails are stored in the outbox if `EMAIL_OUTBOX`
+    setting is enabled.
+
+    Users are consumed lazily. Yields `(sent, failed)` tuple for every batch.
+    """
+    using = using or get_write_database()
+    batch_size = batch_size or flash_settings.EMAIL_BATCH_SIZE
+    base_url = base_url.rstrip("/")
+    host = urlsplit(base_url).netloc
+    fields = ["username", "email", "url"]
+    users = iter(users)
+
+    if token_class_name is not None:
+        # path is reversed once and tokens are inserted into it
+        url_name = TOKEN_EMAILS[token_class_name][0]
+        path = reverse(url_name, kwargs={"token_value": "TOKEN_VALUE"})
+        url_head, url_tail = path.rsplit("TOKEN_VALUE", 1)
+
+    # personalized templates of shared contexts
+    templates = {}
+
+    # opened on first send and reused by all batches
+    connection = get_connection()
+    try:
+        while True:
+            batch = list(islice(users, batch_size))
+            if not batch:
+                break
+
+            messages = []
+            with transaction.atomic(using=using):
+                tokens = [None] * len(batch)
+                if token_class_name is not None:
+                    tokens = get_token_backend().issue_tokens(
+                        token_class_name, batch, using=using
+                    )
+
+                for user, token in zip(batch, tokens):
+                    context = {"host": host}
+                    if get_context is not None:
+                        context.update(get_context(user))
+                    key = tuple(sorted(context.items()))
+                    if key not in templates:
+                        templates[key] = email_templates.personalize(
+                            template_name, context, fields
+                        )
+
+                    values = {
+                        "username": user.username,
+                        "email": user.email,
+                        "url": base_url,
+                    }
+                    if token is not None:
+                        values["url"] += f"{url_head}{token}{url_tail}"
+
+                    if templates[key] is None:
+                        text_content, html_content = email_templates.render(
+                            template_name, {**context, **values}
+                        )
+                    else:
+                        text_content, html_content = (
+                            template.render(values) for template in templates[key]
+                        )
+                    msg = EmailMultiAlternatives(
+                        subject, text_content, flash_settings.EMAIL_FROM, [user.email]
+                    )
+                    msg.attach_alternative(html_content, "text/html")
+                    messages.append(msg)
+
+                if flash_settings.EMAIL_OUTBOX:
+                    OutboxEmail.objects.using(using).bulk_create(
+                        OutboxEmail.from_message(msg) for msg in messages
+                    )
+
+            if flash_settings.EMAIL_OUTBOX:
+                yield len(messages), 0
+                continue
+
+            errors = send_messages(messages, connection)
+            failed = len([error for error in errors if error is not None])
+            yield len(messages) - failed, failed
+    finally:
+        connection.close()
+
+
+def get_token_table(token_class_name):
+    """
+    Returns model and lookup of tokens of given class stored
+    by token backend. Raises `ImproperlyConfigured` if token backend
+    does not store tokens.
+    """
+    token_backend = get_token_backend()
+    if not isinstance(token_backend, ModelTokenBackend):
+        raise ImproperlyConfigured(
+            f"{type(token_backend).__name__} does not store tokens."
+        )
+    return token_backend.token_lookup(token_class_name)
+
+
+# columns of token exports, token state joined with user fields
+TOKEN_EXPORT_COLUMNS = [
+    "user_id",
+    "username",
+    "email",
+    "is_active",
+    "date_joined",
+    "created_at",
+    "expiration_date",
+    "expired",
+]
+
+
+def export_tokens(
+    token_class_name,
+    expires_after=None,
+    expires_before=None,
+    created_after=None,
+    created_before=None,
+    chunk_size=2000,
+    using=None,
+):
+    """
+    Yields dicts with `TOKEN_EXPORT_COLUMNS` of tokens of given class,
+    ordered by primary key and optionally filtered by expiration
+    and creation date windows.
+
+    Rows are read from replica in chunks of `chunk_size`, so memory use
+    stays constant no matter how many tokens are exported.
+    Raises `ImproperlyConfigured` if token backend does not store tokens,
+    when called, before any row is read.
+    """
+    model, lookup = get_token_table(token_class_name)
+    filters = {
+        "expiration_date__gte": expires_after,
+        "expiration_date__lt": expires_before,
+        "created_at__gte": created_after,
+        "created_at__lt": created_before,
+    }
+    tokens = (
+        model.objects.using(using or get_read_database())
+        .filter(**lookup)
+        .filter(**{key: value for key, value in filters.items() if value is not None})
+        .order_by("pk")
+        .values(
+            "user_id",
+            "created_at",
+            "expiration_date",
+            username=F("user__username"),
+            email=F("user__email"),
+            is_active=F("user__is_active"),
+            date_joined=F("user__date_joined"),
+        )
+    )
+
+    return mark_expired(tokens.iterator(chunk_size=chunk_size), timezone.now())
+
+
+def mark_expired(rows, now):
+    """
+    Yields token rows with `expired` column added.
+    """
+    for row in rows:
+        row["expired"] = row["expiration_date"] < now
+        yield row
+
+
+class EchoBuffer:
+    """
+    File-like object returning written value instead of storing it,
+    so CSV writer can produce lines for streaming.
+    """
+
+    def write(self, value):
+        return value
+
+
+def format_rows(rows, file_format, columns):
+    """
+    Yields lines of CSV document with header, or of JSONL document,
+    with given dict rows.
+    """
+    if file_format == "jsonl":
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+        return
+
+    writer = csv.DictWriter(EchoBuffer(), fieldnames=columns)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def get_unactivated_users(cutoff, using=None):
+    """
+    Returns two querysets of primary keys of inactive users, who never
+    logged in. Users of the first one have activation token expired
+    before `cutoff`, ordered by token primary key. Users of the second
+    one have no activation token and joined more than token lifetime
+    before `cutoff`, e.g. their tokens were purged by an older version.
+    The second one is `None` if user model has no `date_joined` field.
+    """
+    using = using or get_write_database()
+    model, lookup = get_token_table(ActivationToken)
+    expired = (
+        model.objects.using(using)
+        .filter(
+            expiration_date__lt=cutoff,
+            user__is_active=False,
+            user__last_login__isnull=True,
+            **lookup,
+        )
+        .order_by("pk")
+        .values_list("user_id", flat=True)
+    )
+
+    try:
+        User._meta.get_field("date_joined")
+    except FieldDoesNotExist:
+        return expired, None
+    tokens = model.objects.using(using).filter(user=OuterRef("pk"), **lookup)
+    tokenless = (
+        User.objects.using(using)
+        .filter(
+            ~Exists(tokens),
+            is_active=False,
+            last_login__isnull=True,
+            date_joined__lt=cutoff - flash_settings.ACTIVATION_TOKEN_LIFETIME,
+        )
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    return expired, tokenless
+
+
+def reap_unactivated_users(cutoff, chunk_size, archive=None, using=None):
+    """
+    Delete at most `chunk_size` users returned by `get_unactivated_users`,
+    those with expired tokens first. Their tokens and email index rows
+    are deleted as well.
+
+    Users are written as JSONL lines to `archive` file, if it is given,
+    before they are deleted. Returns the number of deleted users.
+    """
+    using = using or get_write_database()
+    expired, tokenless = get_unactivated_users(cutoff, using)
+    pks = list(expired[:chunk_size])
+    if tokenless is not None and len(pks) < chunk_size:
+        pks += tokenless[: chunk_size - len(pks)]
+    if not pks:
+        return 0
+
+    fields = [field.attname for field in User._meta.concrete_fields]
+    with transaction.atomic(using=using):
+        # users activated in the meantime are skipped
+        rows = list(
+            User.objects.using(using)
+            .select_for_update()
+            .filter(pk__in=pks, is_active=False, last_login__isnull=True)
+            .values(*fields)
+        )
+        if archive is not None:
+            archive.writelines(
+                json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows
+            )
+            archive.flush()
+
+        User.objects.using(using).filter(
+            pk__in=[row[User._meta.pk.attname] for row in rows]
+        ).delete()
+
+    return len(rows)
+
+
+def import_users(rows, base_url, batch_size=None, using=None):
+    """
+    Create users from an iterable of dicts with `username`, `email`
+    and optional `password` keys, batch by batch.
+
+    Users without password get an unusable one. When `ACTIVATE_ACCOUNT`
+    setting is enabled, activation tokens are created in bulk and
+    activation emails with links starting with `base_url` are sent,
+    or stored in the outbox if `EMAIL_OUTBOX` setting is enabled.
+
+    Rows are consumed lazily. Yields `(created, skipped, failed)` tuple
+    for every batch, where `skipped` counts invalid rows and rows
+    with already taken username or email, and `failed` counts emails
+    that could not be sent.
+    """
+    using = using or get_write_database()
+    batch_size = batch_size or flash_settings.EMAIL_BATCH_SIZE
+    rows = iter(rows)
+
+    # opened on first send and reused by all batches
+    connection = get_connection()
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            yield import_users_batch(batch, base_url, connection, using)
+    finally:
+        connection.close()
+
+
+def import_users_batch(rows, base_url, connection, using):
+    """
+    Create users, email index rows, tokens and emails of a single import batch.
+    """
+    users = {}
+    usernames_by_email = {}
+    for row in rows:
+        username, email = row.get("username"), row.get("email")
+        if not username or not email:
+            continue
+        normalized_email = EmailIndex.normalize(email)
+        if username in users or normalized_email in usernames_by_email:
+            continue
+
+        user = User(
+            username=username,
+            email=email,
+            is_active=not flash_settings.ACTIVATE_ACCOUNT,
+        )
+        if row.get("password"):
+            user.set_password(row["password"])
+        else:
+            user.set_unusable_password()
+        users[username] = user
+        usernames_by_email[normalized_email] = username
+
+    taken = (
+        User.objects.using(using)
+        .filter(Q(username__in=users) | Q(email_index__email__in=usernames_by_email))
+        .values_list("username", "email_index__email")
+    )
+    for username, email in taken:
+        users.pop(username, None)
+        users.pop(usernames_by_email.get(email), None)
+
+    users = list(users.values())
+    skipped = len(rows) - len(users)
+    if not users:
+        return 0, skipped, 0
+
+    messages = []
+    with transaction.atomic(using=using):
+        User.objects.using(using).bulk_create(users)
+        # some databases do not return primary keys from bulk insert
+        if any(user.pk is None for user in users):
+            pks = dict(
+                User.objects.using(using)
+                .filter(username__in=[user.username for user in users])
+                .values_list("username", "pk")
+            )
+            for user in users:
+                user.pk = pks[user.username]
+
+        # bulk insert does not send signals
+        EmailIndex.objects.using(using).bulk_create(
+            EmailIndex(user=user, email=EmailIndex.normalize(user.email))
+            for user in users
+        )
+
+        if not flash_settings.ACTIVATE_ACCOUNT:
+            return len(users), skipped, 0
+
+        tokens = get_token_backend().create_tokens(ActivationToken, users, using=using)
+
+        for user, token in zip(users, tokens):
+            url = base_url.rstrip("/")
+            url += reverse("activate", kwargs={"token_value": token})
+            messages.append(
+                build_mail_with_token(
+                    to_email=user.email,
+                    username=user.username,
+                    url=url,
+                    host=urlsplit(base_url).netloc,
+                    template_name=flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+                    subject=flash_settings.ACTIVATION_EMAIL_SUBJECT,
+                )
+            )
+
+        if flash_settings.EMAIL_OUTBOX:
+            OutboxEmail.objects.using(using).bulk_create(
+                OutboxEmail.from_message(msg) for msg in messages
+            )
+            return len(users), skipped, 0
+
+    errors = send_messages(messages, connection)
+    failed = len([error for error in errors if error is not None])
+    return len(users), skipped, failed
+
+
+def send_messages(messages, connection):
+    """
+    Send messages one by one over given connection.
+
+    Returns a list with `None` for every sent message
+    and an exception for every failed one.
+    """
+    errors = []
+    for msg in messages:
+        msg.connection = connection
+        try:
+            # reopens connection if it was closed after previous failure
+            connection.open()
+            msg.send()
+        except Exception as e:
+            errors.append(e)
+            connection.close()
+        else:
+            errors.append(None)
+    return errors
+
+
+def claim_outbox_emails(batch_size, using=None):
+    """
+    Claim a batch of outbox emails which are due to be sent.
+
+    Claimed emails are hidden from other workers for
+    `EMAIL_OUTBOX_CLAIM_TIMEOUT`, so the same email is not sent twice.
+    If worker dies before sending, emails are claimed again after that time.
+    """
+    using = using or get_write_database()
+    now = timezone.now()
+
+    with transaction.atomic(using=using):
+        emails = list(
+            OutboxEmail.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(
+                sent_at__isnull=True,
+                next_attempt_at__lte=now,
+                attempts__lt=flash_settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+            )
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        lease_end = now + flash_settings.EMAIL_OUTBOX_CLAIM_TIMEOUT
+        OutboxEmail.objects.using(using).filter(
+            pk__in=[email.pk for email in emails]
+        ).update(next_attempt_at=lease_end)
+
+    for email in emails:
+        email.next_attempt_at = lease_end
+    return emails
+
+
+def send_outbox_emails(batch_size=100, using=None):
+    """
+    Send one batch of outbox emails over a single connection.
+    Failed emails, including all emails of a batch whose connection
+    cannot be opened, are retried with exponential backoff.
+
+    Sending stops halfway through `EMAIL_OUTBOX_CLAIM_TIMEOUT` and every
+    SMTP operation is limited to a tenth of it, so no email is sent after
+    its claim expires and another worker may claim it. Emails left unsent
+    are released for the next batch.
+
+    Returns a `(sent, failed)` tuple.
+    """
+    using = using or get_write_database()
+    emails = claim_outbox_emails(batch_size, using)
+    if not emails:
+        return 0, 0
+
+    claim_timeout = flash_settings.EMAIL_OUTBOX_CLAIM_TIMEOUT
+    send_deadline = emails[0].next_attempt_at - claim_timeout / 2
+    timeout = (claim_timeout / 10).total_seconds()
+    if settings.EMAIL_TIMEOUT:
+        timeout = min(timeout, settings.EMAIL_TIMEOUT)
+
+    connection = get_connection(timeout=timeout)
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            record_outbox_failure(email, e)
+        OutboxEmail.objects.using(using).bulk_update(
+            emails, ["attempts", "next_attempt_at", "last_error"]
+        )
+        return 0, len(emails)
+
+    sent, failed = 0, 0
+    try:
+        for i, email in enumerate(emails):
+            if timezone.now() >= send_deadline:
+                # claim may expire before next email is sent
+                unsent = emails[i:]
+                for unsent_email in unsent:
+                    unsent_email.next_attempt_at = timezone.now()
+                OutboxEmail.objects.using(using).bulk_update(
+                    unsent, ["next_attempt_at"]
+                )
+                break
+
+            try:
+                email.build_message(connection).send()
+            except Exception as e:
+                record_outbox_failure(email, e)
+                failed += 1
+            else:
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                sent += 1
+            email.save(
+                update_fields=["attempts", "next_attempt_at", "last_error", "sent_at"]
+            )
+    finally:
+        connection.close()
+
+    return sent, failed
+
+
+def record_outbox_failure(email, error):
+    """
+    Count failed attempt of outbox email and schedule the next one
+    with exponential backoff, nothing is saved.
+    """
+    email.attempts += 1
+    delay = flash_settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+    email.next_attempt_at = timezone.now() + delay
+    email.last_error = repr(error)
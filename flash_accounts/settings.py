@@ -2,19 +2,63 @@ from django.core.signals import setting_changed
 from django.utils import timezone
 from django.conf import settings
 
+import string
+
 
 DEFAULT_SETTINGS = {
+    # class issuing and validating activation and password reset tokens
+    "TOKEN_BACKEND": "flash_accounts.tokens.ModelTokenBackend",
+    # random tokens settings
+    "TOKEN_GENERATOR": "flash_accounts.generators.SecretsTokenGenerator",
+    "TOKEN_LENGTH": 55,
+    "TOKEN_ALPHABET": string.ascii_letters + string.digits,
+    "TOKEN_POOL_SIZE": 1000,
+    # repeated password reset and activation resend requests within
+    # that time keep previous token and send no email, zero disables it
+    "TOKEN_REISSUE_COOLDOWN": timezone.timedelta(0),
+    # cache of token lookups, name of a cache declared in `CACHES`,
+    # empty string disables caching
+    "TOKEN_CACHE": "",
+    "TOKEN_CACHE_TIMEOUT": timezone.timedelta(minutes=10),
+    "TOKEN_CACHE_MISS_TIMEOUT": timezone.timedelta(seconds=30),
+    # stored responses of sign up requests sent with `Idempotency-Key` header,
+    # name of a cache declared in `CACHES`, empty string ignores the header
+    "IDEMPOTENCY_CACHE": "",
+    "IDEMPOTENCY_KEY_TTL": timezone.timedelta(hours=24),
+    "IDEMPOTENCY_LOCK_TIMEOUT": timezone.timedelta(seconds=10),
+    # database aliases, writes and reads which must follow them go to primary,
+    # read-only checks go to replica, empty string sends them to primary too
+    "PRIMARY_DATABASE": "default",
+    "REPLICA_DATABASE": "",
+    # class collecting stage durations and event counters
+    "METRICS_BACKEND": "flash_accounts.metrics.NullMetrics",
     # account activation feature settings
     "ACTIVATE_ACCOUNT": True,
     "ACTIVATION_TOKEN_LIFETIME": timezone.timedelta(hours=1),
     "ACTIVATION_EMAIL_TEMPLATE": "flash_accounts/activate",
     "ACTIVATION_EMAIL_SUBJECT": "Activate your account.",
+    # time after activation token expiry, when unactivated users are reaped
+    "UNACTIVATED_USER_GRACE_PERIOD": timezone.timedelta(days=7),
     # password reset feature settings
     "PASSWORD_RESET_TOKEN_LIFETIME": timezone.timedelta(hours=1),
     "PASSWORD_RESET_EMAIL_TEMPLATE": "flash_accounts/password_reset",
     "PASSWORD_RESET_EMAIL_SUBJECT": "Password reset request.",
+    # throttling of password reset and activation resend requests,
+    # e.g. "5/hour", empty string disables throttling
+    "THROTTLE_EMAIL_RATE": "",
+    "THROTTLE_IP_RATE": "",
     # email address, from which emails will appear to be sent
     "EMAIL_FROM": getattr(settings, "DEFAULT_EMAIL_FROM", "change@me.com"),
+    # scheme and host of links in emails sent from the admin,
+    # e.g. "https://example.com", empty string disables resending
+    "PUBLIC_BASE_URL": "",
+    # number of emails rendered and sent at once by bulk services
+    "EMAIL_BATCH_SIZE": 100,
+    # email outbox settings
+    "EMAIL_OUTBOX": False,
+    "EMAIL_OUTBOX_MAX_ATTEMPTS": 5,
+    "EMAIL_OUTBOX_RETRY_DELAY": timezone.timedelta(minutes=1),
+    "EMAIL_OUTBOX_CLAIM_TIMEOUT": timezone.timedelta(minutes=5),
 }
 
 
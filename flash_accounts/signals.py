@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.dispatch import receiver
+
+from .models import EmailIndex
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def update_email_index(sender, instance, created, update_fields, using, **kwargs):
+    """
+    Store normalized email of saved user in the database user is saved to.
+    Saves of other fields only, e.g. `last_login`, are skipped.
+    """
+
+    if update_fields is not None and "email" not in update_fields:
+        return
+
+    email = EmailIndex.normalize(instance.email)
+    email_index = EmailIndex.objects.using(using)
+    if created:
+        email_index.create(user=instance, email=email)
+    elif not email_index.filter(user=instance).update(email=email):
+        email_index.create(user=instance, email=email)
@@ -1,24 +1,66 @@
-from django.test import TestCase, SimpleTestCase
+from django.test import TestCase, SimpleTestCase, RequestFactory, override_settings
+from django.core.management import call_command, CommandError
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.auth import get_user_model
 from .settings import flash_settings
-from django.template import loader
+from django.template import loader, engines
 from django.utils import timezone
 from django.conf import settings
 from django.urls import reverse
 from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib import admin as django_admin, messages
+from django.apps import apps
 
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
 from rest_framework import status
 
 from .settings import settings as flash_settings_module
-from .models import ActivationToken, PasswordResetToken
-
+from .models import (
+    ActivationToken,
+    PasswordResetToken,
+    OutboxEmail,
+    EmailIndex,
+    Token,
+    TokenKind,
+)
+from .mail_templates import CompiledTemplate, email_templates
+from .tokens import SignedTokenBackend, ModelTokenBackend
+from .generators import (
+    SecretsTokenGenerator,
+    PooledTokenGenerator,
+    get_token_generator,
+)
+from .metrics import NullMetrics, HistogramMetrics, get_metrics
+from .views import metrics_view, export_tokens_view
+from .idempotency import idempotency_store
+from .admin import TokenAdmin, TokenStatusFilter, EstimatedCountPaginator
+from . import services
+
+from importlib import import_module
+from unittest import mock, skipUnless
+from io import StringIO
+import tempfile
+import csv
+import json
+import os
 import string
+import re
 
 
 User = get_user_model()
 
 
+def get_token_from_email(message):
+    """
+    Extract raw token value from the link sent in email.
+    """
+
+    return re.search(r"/([A-Za-z0-9]{55})/", message.body).group(1)
+
+
 class AppSettingsTestCase(SimpleTestCase):
     def test_loading_user_settings_correctly(self):
         user_settings = getattr(settings, "FLASH_SETTINGS", {})
@@ -33,6 +75,50 @@ class AppSettingsTestCase(SimpleTestCase):
                 self.assertEqual(value, getattr(flash_settings, setting))
 
 
+class TokenGeneratorTestCase(SimpleTestCase):
+    def test_generate_many(self):
+        generator = SecretsTokenGenerator(length=20, alphabet="abc")
+        tokens = generator.generate_many(100)
+
+        self.assertEqual(len(tokens), 100)
+        self.assertEqual(len(set(tokens)), 100)
+        for token in tokens:
+            self.assertEqual(len(token), 20)
+            self.assertTrue(set(token) <= set("abc"))
+
+    def test_invalid_alphabet(self):
+        for alphabet in ("a", "abca", "abcą"):
+            with self.assertRaises(ValueError):
+                SecretsTokenGenerator(alphabet=alphabet)
+
+    def test_pool_refilled(self):
+        generator = PooledTokenGenerator(pool_size=3)
+        self.assertEqual(len(generator.pool), 3)
+
+        tokens = [generator.generate() for _ in range(4)]
+        self.assertEqual(len(set(tokens)), 4)
+        self.assertEqual(len(generator.pool), 2)
+
+    def test_pool_cleared_in_forked_process(self):
+        generator = PooledTokenGenerator(pool_size=3)
+        pooled = set(generator.pool)
+        generator.pid = None
+
+        self.assertNotIn(generator.generate(), pooled)
+        self.assertTrue(pooled.isdisjoint(generator.pool))
+
+    @override_settings(
+        FLASH_SETTINGS={
+            "TOKEN_GENERATOR": "flash_accounts.generators.PooledTokenGenerator",
+            "TOKEN_LENGTH": 32,
+        }
+    )
+    def test_generator_from_settings(self):
+        generator = get_token_generator()
+        self.assertIsInstance(generator, PooledTokenGenerator)
+        self.assertEqual(len(generator.generate()), 32)
+
+
 class ActivationTokenTestCase(TestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(
@@ -56,6 +142,10 @@ class ActivationTokenTestCase(TestCase):
         for char in self.token.token:
             self.assertIn(char, self.characters)
 
+        self.token.refresh_from_db()
+        self.assertEqual(self.token.digest, self.token.hash_token(self.token.token))
+        self.assertEqual(len(self.token.digest), 64)
+
     def test_set_expiration_date(self):
         self.assertEqual(self.token.expiration_date, None)
 
@@ -109,6 +199,10 @@ class PasswordResetTokenTestCase(TestCase):
         for char in self.token.token:
             self.assertIn(char, self.characters)
 
+        self.token.refresh_from_db()
+        self.assertEqual(self.token.digest, self.token.hash_token(self.token.token))
+        self.assertEqual(len(self.token.digest), 64)
+
     def test_set_expiration_date(self):
         self.assertEqual(self.token.expiration_date, None)
 
@@ -182,6 +276,19 @@ class RegisterTestCase(APITestCase):
         else:
             self.assertEqual(User.objects.first().is_active, True)
 
+    def test_user_inserted_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data=self.valid_data)
+
+        user_table = User._meta.db_table
+        writes = [
+            query["sql"]
+            for query in queries.captured_queries
+            if user_table in query["sql"] and not query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith("INSERT"))
+
     def test_register_user_invalid_data(self):
         response = self.client.post(self.url, data=self.invalid_passwords_data)
 
@@ -204,6 +311,34 @@ class RegisterTestCase(APITestCase):
 
     if flash_settings.ACTIVATE_ACCOUNT:
 
+        def test_query_budget(self):
+            # username and email uniqueness checks, user insert,
+            # email index insert, token insert plus savepoint queries
+            with self.assertNumQueries(7):
+                self.client.post(self.url, data=self.valid_data)
+
+        def test_email_sent_after_commit(self):
+            savepoints = []
+
+            def send(*args, **kwargs):
+                savepoints.append(list(connection.savepoint_ids))
+                return 1
+
+            expected = list(connection.savepoint_ids)
+            with mock.patch.object(
+                mail.EmailMultiAlternatives, "send", side_effect=send
+            ):
+                self.client.post(self.url, data=self.valid_data)
+
+            self.assertEqual(savepoints, [expected])
+
+        @override_settings(FLASH_SETTINGS={"EMAIL_OUTBOX": True})
+        def test_query_budget_with_outbox(self):
+            # same as without outbox plus outbox insert,
+            # no savepoint is nested in sign-up transaction
+            with self.assertNumQueries(8):
+                self.client.post(self.url, data=self.valid_data)
+
         def test_email_token_generated(self):
             self.client.post(self.url, data=self.valid_data)
 
@@ -211,7 +346,7 @@ class RegisterTestCase(APITestCase):
 
             self.assertEqual(ActivationToken.objects.count(), 1)
             self.assertEqual(token.user.username, "testUser")
-            self.assertEqual(len(token.token), 55)
+            self.assertEqual(len(token.digest), 64)
             self.assertLess(
                 token.expiration_date,
                 timezone.now()
@@ -230,9 +365,11 @@ class RegisterTestCase(APITestCase):
             self.assertEqual(len(mail.outbox), 1)
 
             token = ActivationToken.objects.first()
+            token_value = get_token_from_email(mail.outbox[0])
+            self.assertEqual(token.digest, token.hash_token(token_value))
 
             url = "http://testserver"
-            url += reverse("activate", kwargs={"token_value": token.token})
+            url += reverse("activate", kwargs={"token_value": token_value})
             context = {
                 "url": url,
                 "username": "testUser",
@@ -273,13 +410,26 @@ class PasswordResetTestCase(APITestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_email_sent_outside_transaction(self):
+        savepoints = []
+
+        def send(*args, **kwargs):
+            savepoints.append(list(connection.savepoint_ids))
+            return 1
+
+        expected = list(connection.savepoint_ids)
+        with mock.patch.object(mail.EmailMultiAlternatives, "send", side_effect=send):
+            self.client.post(self.url, data=self.valid_data)
+
+        self.assertEqual(savepoints, [expected])
+
     def test_token_generated(self):
         self.client.post(self.url, data=self.valid_data)
         self.assertEqual(PasswordResetToken.objects.count(), 1)
 
         token = PasswordResetToken.objects.first()
         self.assertEqual(token.user.username, "testUser")
-        self.assertEqual(len(token.token), 55)
+        self.assertEqual(len(token.digest), 64)
         self.assertLess(
             token.expiration_date,
             timezone.now()
@@ -310,9 +460,11 @@ class PasswordResetTestCase(APITestCase):
         self.assertEqual(len(mail.outbox), 1)
 
         token = PasswordResetToken.objects.first()
+        token_value = get_token_from_email(mail.outbox[0])
+        self.assertEqual(token.digest, token.hash_token(token_value))
 
         url = "http://testserver"
-        url += reverse("password_reset_confirm", kwargs={"token_value": token.token})
+        url += reverse("password_reset_confirm", kwargs={"token_value": token_value})
         context = {
             "url": url,
             "username": "testUser",
@@ -374,6 +526,13 @@ class PasswordResetConfirmTestCase(APITestCase):
         response = self.client.post(self.invalid_url, data=self.valid_data)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_invalid_token_not_hashing_password(self):
+        with mock.patch("flash_accounts.services.make_password") as make_password:
+            response = self.client.post(self.invalid_url, data=self.valid_data)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        make_password.assert_not_called()
+
     def test_expired_token(self):
         self.token.expiration_date = timezone.now() - timezone.timedelta(seconds=5)
         self.token.save()
@@ -392,6 +551,18 @@ class PasswordResetConfirmTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {"password": "Password has been changed."})
         self.assertEqual(self.user.check_password("newtestpassWORD##1"), True)
+        self.assertEqual(PasswordResetToken.objects.count(), 0)
+
+    def test_token_used_once(self):
+        self.client.post(self.valid_url, data=self.valid_data)
+        response = self.client.post(self.valid_url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_query_budget(self):
+        # token select, token delete and user update, plus savepoint
+        # and release of the transaction nested in the test one
+        with self.assertNumQueries(5):
+            self.client.post(self.valid_url, data=self.valid_data)
 
 
 if flash_settings.ACTIVATE_ACCOUNT:
@@ -424,6 +595,18 @@ if flash_settings.ACTIVATE_ACCOUNT:
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(response.data, {"account": "Account activated."})
             self.assertEqual(self.user.is_active, True)
+            self.assertEqual(ActivationToken.objects.count(), 0)
+
+        def test_token_used_once(self):
+            self.client.get(self.valid_url)
+            response = self.client.get(self.valid_url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        def test_query_budget(self):
+            # token select, token delete and user update, plus savepoint
+            # and release of the transaction nested in the test one
+            with self.assertNumQueries(5):
+                self.client.get(self.valid_url)
 
         def test_url_missing_token(self):
             self.valid_url = self.valid_url[:-56]
@@ -510,9 +693,11 @@ if flash_settings.ACTIVATE_ACCOUNT:
             self.client.post(self.url, data=self.valid_data)
             self.assertEqual(len(mail.outbox), 1)
             self.token.refresh_from_db()
+            token_value = get_token_from_email(mail.outbox[0])
+            self.assertEqual(self.token.digest, self.token.hash_token(token_value))
 
             url = "http://testserver"
-            url += reverse("activate", kwargs={"token_value": self.token.token})
+            url += reverse("activate", kwargs={"token_value": token_value})
             context = {
                 "url": url,
                 "username": "testUser",
@@ -533,3 +718,1754 @@ if flash_settings.ACTIVATE_ACCOUNT:
 
             self.assertEqual(template_html, email_html)
             self.assertEqual(template_txt, email_txt)
+
+
+class EmailTemplateCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.context = {
+            "url": "http://testserver/?a=1&b=<2>",
+            "username": "<testUser>",
+            "host": "testserver",
+        }
+
+    def test_default_templates_use_fast_path(self):
+        txt, html = email_templates.get(flash_settings.ACTIVATION_EMAIL_TEMPLATE)
+        self.assertNotEqual(txt.parts, None)
+        self.assertNotEqual(html.parts, None)
+
+    def test_render_same_as_loader(self):
+        for template_name in (
+            flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+            flash_settings.PASSWORD_RESET_EMAIL_TEMPLATE,
+        ):
+            text_content, html_content = email_templates.render(
+                template_name, self.context
+            )
+            self.assertEqual(
+                text_content,
+                loader.render_to_string(f"{template_name}.txt", self.context),
+            )
+            self.assertEqual(
+                html_content,
+                loader.render_to_string(f"{template_name}.html", self.context),
+            )
+
+    def test_only_simple_templates_split(self):
+        template = CompiledTemplate(
+            engines["django"].from_string("{% if username %}{{ username }}{% endif %}")
+        )
+        self.assertEqual(template.parts, None)
+
+        html = CompiledTemplate(engines["django"].from_string("{{ username }}"))
+        self.assertEqual(html.parts, ["", "username", ""])
+
+    def test_personalized_same_as_render(self):
+        for template_name in (
+            flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+            flash_settings.PASSWORD_RESET_EMAIL_TEMPLATE,
+        ):
+            templates = email_templates.personalize(
+                template_name, {"host": "testserver"}, ["username", "url"]
+            )
+            self.assertEqual(
+                tuple(template.render(self.context) for template in templates),
+                email_templates.render(template_name, self.context),
+            )
+
+    def test_only_fields_output_as_is_personalized(self):
+        for source in ("{{ username|upper }}", "{{ username|length }}"):
+            template = CompiledTemplate(engines["django"].from_string(source))
+            with mock.patch.object(
+                email_templates, "get", return_value=(template, template)
+            ):
+                self.assertEqual(
+                    email_templates.personalize("campaign", {}, ["username"]), None
+                )
+
+    def test_cache_cleared_on_settings_change(self):
+        email_templates.get(flash_settings.ACTIVATION_EMAIL_TEMPLATE)
+
+        with override_settings(FLASH_SETTINGS={}):
+            self.assertEqual(email_templates._templates, {})
+
+
+class ThrottlingTestCase(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.addCleanup(cache.clear)
+        for i in range(3):
+            User.objects.create_user(
+                username=f"testUser{i}",
+                email=f"testemail{i}@test.com",
+                password="testpassword123",
+            )
+        self.url = reverse("password_reset")
+
+    @override_settings(FLASH_SETTINGS={"THROTTLE_EMAIL_RATE": "2/hour"})
+    def test_email_throttled(self):
+        for _ in range(2):
+            response = self.client.post(self.url, {"email": "testemail0@test.com"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {"email": "TESTemail0@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(len(mail.outbox), 2)
+
+        response = self.client.post(self.url, {"email": "testemail1@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(FLASH_SETTINGS={"THROTTLE_IP_RATE": "2/hour"})
+    def test_ip_throttled(self):
+        for i in range(2):
+            response = self.client.post(self.url, {"email": f"testemail{i}@test.com"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(self.url, {"email": "testemail2@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(FLASH_SETTINGS={"THROTTLE_EMAIL_RATE": "2/hour"})
+    def test_email_throttle_ignores_list_body(self):
+        response = self.client.post(
+            self.url, [{"email": "testemail0@test.com"}], format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_throttling_disabled_by_default(self):
+        for _ in range(5):
+            response = self.client.post(self.url, {"email": "testemail0@test.com"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.valid_data = {
+            "username": "testUser",
+            "email": "testemail@test.com",
+            "password": "testpassword123",
+            "password2": "testpassword123",
+        }
+
+    def test_null_metrics_by_default(self):
+        metrics = get_metrics()
+        self.assertIsInstance(metrics, NullMetrics)
+        self.assertIs(metrics.timer("sign_up"), metrics.timer("token_write"))
+        self.assertEqual(metrics.render_prometheus(), "")
+
+    @override_settings(
+        FLASH_SETTINGS={"METRICS_BACKEND": "flash_accounts.metrics.HistogramMetrics"}
+    )
+    def test_sign_up_stages_measured(self):
+        self.client.post(reverse("sign_up"), data=self.valid_data)
+
+        metrics = get_metrics()
+        self.assertIsInstance(metrics, HistogramMetrics)
+        stages = {
+            "sign_up",
+            "password_validation",
+            "unique_check",
+            "password_hash",
+            "user_write",
+        }
+        if flash_settings.ACTIVATE_ACCOUNT:
+            stages |= {"token_write", "template_render", "email_send"}
+            self.assertEqual(metrics.counters["email_sent"], 1)
+        self.assertTrue(stages <= set(metrics.histograms))
+        self.assertEqual(metrics.counters["sign_up"], 1)
+
+    def test_prometheus_format(self):
+        metrics = HistogramMetrics()
+        metrics.observe("token_write", 0.003)
+        metrics.observe("token_write", 20)
+        metrics.increment("sign_up")
+
+        text = metrics.render_prometheus()
+        self.assertIn(
+            'flash_accounts_stage_seconds_bucket{stage="token_write",le="0.001"} 0',
+            text,
+        )
+        self.assertIn(
+            'flash_accounts_stage_seconds_bucket{stage="token_write",le="0.005"} 1',
+            text,
+        )
+        self.assertIn(
+            'flash_accounts_stage_seconds_bucket{stage="token_write",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn('flash_accounts_stage_seconds_count{stage="token_write"} 2', text)
+        self.assertIn('flash_accounts_events_total{event="sign_up"} 1', text)
+
+    @override_settings(
+        FLASH_SETTINGS={"METRICS_BACKEND": "flash_accounts.metrics.HistogramMetrics"}
+    )
+    def test_metrics_view(self):
+        get_metrics().increment("sign_up")
+
+        response = metrics_view(RequestFactory().get("/metrics/"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            b'flash_accounts_events_total{event="sign_up"} 1', response.content
+        )
+
+
+@override_settings(FLASH_SETTINGS={"TOKEN_CACHE": "default"})
+class TokenCacheTestCase(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.token = PasswordResetToken.objects.create(user=self.user)
+        self.token.set_up_token()
+        self.token.save()
+        self.url = reverse(
+            "password_reset_confirm", kwargs={"token_value": self.token.token}
+        )
+        self.data = {"password": "newpassword123", "password2": "newpassword123"}
+
+    def test_unknown_token_cached(self):
+        url = reverse("password_reset_confirm", kwargs={"token_value": "invalid"})
+        self.client.post(url, data=self.data)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_token_cached(self):
+        self.token.expiration_date = timezone.now() - timezone.timedelta(seconds=5)
+        self.token.save()
+        self.client.post(self.url, data=self.data)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_consumed_token_cached_as_unknown(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_token_consumed(self):
+        backend = ModelTokenBackend()
+        backend.get_token(PasswordResetToken, self.token.digest)
+
+        # token delete and user update, plus savepoint queries
+        with self.assertNumQueries(4):
+            response = self.client.post(self.url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reissued_token_invalidated(self):
+        backend = ModelTokenBackend()
+        backend.get_token(PasswordResetToken, self.token.digest)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_token = backend.create_token(PasswordResetToken, self.user)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        url = reverse("password_reset_confirm", kwargs={"token_value": new_token})
+        response = self.client.post(url, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(FLASH_SETTINGS={})
+    def test_disabled_by_default(self):
+        url = reverse("password_reset_confirm", kwargs={"token_value": "invalid"})
+        self.client.post(url, data=self.data)
+
+        with self.assertNumQueries(1):
+            self.client.post(url, data=self.data)
+
+
+@override_settings(
+    FLASH_SETTINGS={"TOKEN_REISSUE_COOLDOWN": timezone.timedelta(minutes=1)}
+)
+class TokenReissueCooldownTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.url = reverse("password_reset")
+        self.data = {"email": self.user.email}
+
+    def test_repeated_request_coalesced(self):
+        self.client.post(self.url, data=self.data)
+        digest = PasswordResetToken.objects.get().digest
+
+        response = self.client.post(self.url, data=self.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            {"response": f"Email with instructions has been sent to {self.user.email}"},
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(PasswordResetToken.objects.get().digest, digest)
+
+    def test_coalesced_request_does_not_write(self):
+        self.client.post(self.url, data=self.data)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data=self.data)
+
+        token_table = PasswordResetToken._meta.db_table
+        writes = [
+            query["sql"]
+            for query in queries.captured_queries
+            if token_table in query["sql"] and not query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(writes, [])
+
+    def test_reissued_after_cooldown(self):
+        self.client.post(self.url, data=self.data)
+        PasswordResetToken.objects.update(
+            expiration_date=timezone.now()
+            + flash_settings.PASSWORD_RESET_TOKEN_LIFETIME
+            - timezone.timedelta(minutes=2)
+        )
+
+        self.client.post(self.url, data=self.data)
+
+        self.assertEqual(len(mail.outbox), 2)
+        token_value = get_token_from_email(mail.outbox[-1])
+        self.assertEqual(
+            PasswordResetToken.objects.get().digest,
+            PasswordResetToken.hash_token(token_value),
+        )
+
+    def test_concurrently_reissued_token_kept(self):
+        self.client.post(self.url, data=self.data)
+        token = PasswordResetToken.objects.get()
+        PasswordResetToken.objects.update(expiration_date=timezone.now())
+
+        backend = ModelTokenBackend()
+        self.assertFalse(backend.reissue_token(PasswordResetToken, token, "default"))
+
+    @override_settings(FLASH_SETTINGS={})
+    def test_disabled_by_default(self):
+        self.client.post(self.url, data=self.data)
+        self.client.post(self.url, data=self.data)
+
+        self.assertEqual(len(mail.outbox), 2)
+
+    if flash_settings.ACTIVATE_ACCOUNT:
+
+        def test_activation_resend_coalesced(self):
+            self.user.is_active = False
+            self.user.save()
+            url = reverse("activate_resend")
+
+            self.client.post(url, data=self.data)
+            response = self.client.post(url, data=self.data)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(FLASH_SETTINGS={"IDEMPOTENCY_CACHE": "default"})
+class IdempotencyKeyTestCase(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.url = reverse("sign_up")
+        self.data = {
+            "username": "testUser",
+            "email": "testemail@test.com",
+            "password": "testpassword123",
+            "password2": "testpassword123",
+        }
+        self.headers = {"Idempotency-Key": "3f1e2b7c-key"}
+
+    def test_retry_replays_response(self):
+        first = self.client.post(self.url, data=self.data, headers=self.headers)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data=self.data, headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, first.data)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(User.objects.count(), 1)
+        if flash_settings.ACTIVATE_ACCOUNT:
+            self.assertEqual(len(mail.outbox), 1)
+
+    def test_key_reused_with_other_data(self):
+        self.client.post(self.url, data=self.data, headers=self.headers)
+        data = {**self.data, "username": "otherUser", "email": "other@test.com"}
+
+        response = self.client.post(self.url, data=data, headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_requests_without_key_not_replayed(self):
+        self.client.post(self.url, data=self.data)
+
+        response = self.client.post(self.url, data=self.data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_duplicate_waits_for_response(self):
+        key, lock_key = idempotency_store.make_keys(self.headers["Idempotency-Key"])
+        cache.add(lock_key, True)
+        fingerprint = idempotency_store.fingerprint(
+            mock.Mock(path=self.url, data=self.data)
+        )
+
+        def finish_first_request(interval):
+            cache.set(key, (fingerprint, 201, {"username": "testUser"}))
+
+        with mock.patch("flash_accounts.idempotency.time.sleep") as sleep:
+            sleep.side_effect = finish_first_request
+            with self.assertNumQueries(0):
+                response = self.client.post(
+                    self.url, data=self.data, headers=self.headers, format="json"
+                )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"username": "testUser"})
+
+    def test_concurrent_duplicate_retried_when_first_request_fails(self):
+        key, lock_key = idempotency_store.make_keys(self.headers["Idempotency-Key"])
+        cache.add(lock_key, True)
+
+        def fail_first_request(interval):
+            cache.delete(lock_key)
+
+        with mock.patch("flash_accounts.idempotency.time.sleep") as sleep:
+            sleep.side_effect = fail_first_request
+            response = self.client.post(self.url, data=self.data, headers=self.headers)
+
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertIsNotNone(cache.get(key))
+
+    def test_fingerprint_keyed_on_secret_key(self):
+        request = mock.Mock(path=self.url, data=self.data)
+        fingerprint = idempotency_store.fingerprint(request)
+
+        with override_settings(SECRET_KEY="other-secret-key"):
+            self.assertNotEqual(idempotency_store.fingerprint(request), fingerprint)
+
+    @override_settings(
+        FLASH_SETTINGS={
+            "IDEMPOTENCY_CACHE": "default",
+            "IDEMPOTENCY_LOCK_TIMEOUT": timezone.timedelta(0),
+        }
+    )
+    def test_concurrent_duplicate_conflict_on_timeout(self):
+        _, lock_key = idempotency_store.make_keys(self.headers["Idempotency-Key"])
+        cache.add(lock_key, True)
+
+        response = self.client.post(self.url, data=self.data, headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(User.objects.count(), 0)
+
+    def test_lock_released(self):
+        _, lock_key = idempotency_store.make_keys(self.headers["Idempotency-Key"])
+
+        self.client.post(self.url, data=self.data, headers=self.headers)
+
+        self.assertIsNone(cache.get(lock_key))
+
+    @override_settings(FLASH_SETTINGS={})
+    def test_disabled_by_default(self):
+        self.client.post(self.url, data=self.data, headers=self.headers)
+
+        response = self.client.post(self.url, data=self.data, headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TokenAdminTestCase(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                username=f"testUser{i}",
+                email=f"TestEmail{i}@test.com",
+                password="testpassword123",
+            )
+            for i in range(3)
+        ]
+        for user in self.users:
+            token = PasswordResetToken(user=user)
+            token.set_up_token()
+            token.save()
+        self.model_admin = TokenAdmin(PasswordResetToken, django_admin.site)
+        self.request = RequestFactory().post("/admin/")
+
+    def test_tokens_registered(self):
+        self.assertIsInstance(django_admin.site._registry[ActivationToken], TokenAdmin)
+        self.assertIsInstance(
+            django_admin.site._registry[PasswordResetToken], TokenAdmin
+        )
+
+    def test_status_filter(self):
+        PasswordResetToken.objects.filter(user=self.users[0]).update(
+            expiration_date=timezone.now() - timezone.timedelta(seconds=5)
+        )
+        tokens = PasswordResetToken.objects.all()
+
+        def filtered(value):
+            status_filter = TokenStatusFilter(
+                self.request,
+                {"status": [value]},
+                PasswordResetToken,
+                self.model_admin,
+            )
+            return status_filter.queryset(self.request, tokens)
+
+        self.assertEqual(filtered("expired").count(), 1)
+        self.assertEqual(filtered("pending").count(), 2)
+
+    def test_search_by_normalized_email(self):
+        queryset, _ = self.model_admin.get_search_results(
+            self.request, PasswordResetToken.objects.all(), " testemail1@TEST.com"
+        )
+
+        self.assertEqual(list(queryset), [self.users[1].password_reset_token])
+
+    def test_paginator_count_capped(self):
+        paginator = EstimatedCountPaginator(
+            PasswordResetToken.objects.order_by("pk"), 1
+        )
+        paginator.max_count = 2
+
+        self.assertEqual(paginator.count, 2)
+
+    def test_expire_now_one_statement(self):
+        with mock.patch.object(self.model_admin, "message_user"):
+            with self.assertNumQueries(1):
+                self.model_admin.expire_now(
+                    self.request, PasswordResetToken.objects.all()
+                )
+
+        self.assertTrue(
+            all(token.expired for token in PasswordResetToken.objects.all())
+        )
+
+    @override_settings(FLASH_SETTINGS={"TOKEN_CACHE": "default"})
+    def test_expire_now_discards_cached_tokens(self):
+        token = PasswordResetToken.objects.first()
+        backend = ModelTokenBackend()
+        backend.get_token(PasswordResetToken, token.digest)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.expire_tokens(PasswordResetToken.objects.all())
+
+        cached = backend.get_token(PasswordResetToken, token.digest)
+        self.assertLess(cached["expiration_date"], timezone.now())
+
+    @override_settings(FLASH_SETTINGS={"PUBLIC_BASE_URL": "https://example.com/"})
+    def test_reissue_and_resend(self):
+        digests = set(PasswordResetToken.objects.values_list("digest", flat=True))
+
+        with mock.patch.object(self.model_admin, "message_user") as message_user:
+            self.model_admin.reissue_and_resend(
+                self.request, PasswordResetToken.objects.all()
+            )
+
+        message_user.assert_called_once_with(
+            self.request, "Reissued 3 tokens, 0 emails failed to send."
+        )
+        self.assertEqual(len(mail.outbox), 3)
+        for msg in mail.outbox:
+            token = PasswordResetToken.objects.get(
+                digest=PasswordResetToken.hash_token(get_token_from_email(msg))
+            )
+            self.assertEqual(token.user.email, msg.to[0])
+            self.assertNotIn(token.digest, digests)
+            self.assertIn("https://example.com/", msg.body)
+            self.assertNotIn("testserver", msg.body)
+
+    def test_reissue_requires_public_base_url(self):
+        with mock.patch.object(self.model_admin, "message_user") as message_user:
+            self.model_admin.reissue_and_resend(
+                self.request, PasswordResetToken.objects.all()
+            )
+
+        message_user.assert_called_once_with(
+            self.request,
+            "Set PUBLIC_BASE_URL setting to resend tokens.",
+            level=messages.ERROR,
+        )
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_activation_tokens_of_active_users_not_reissued(self):
+        self.users[0].is_active = False
+        self.users[0].save()
+        for user in self.users[:2]:
+            token = ActivationToken(user=user)
+            token.set_up_token()
+            token.save()
+
+        reissued, failed = services.reissue_and_send_tokens(
+            ActivationToken.objects.all(), "https://example.com"
+        )
+
+        self.assertEqual((reissued, failed), (1, 0))
+        self.assertEqual([msg.to[0] for msg in mail.outbox], [self.users[0].email])
+
+    def test_reissue_batches_take_constant_queries(self):
+        # select, savepoint, update and savepoint release of two batches
+        with self.assertNumQueries(2 * 4):
+            services.reissue_and_send_tokens(
+                PasswordResetToken.objects.all(), "https://example.com", batch_size=2
+            )
+
+
+class EmailIndexTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="TestEmail@Test.com",
+            password="testpassword123",
+        )
+
+    def test_migration_indexes_existing_users(self):
+        User.objects.create_user(username="otherUser", email="Other@Test.com")
+        EmailIndex.objects.all().delete()
+
+        migration = import_module("flash_accounts.migrations.0005_emailindex")
+        with mock.patch.object(migration, "BATCH_SIZE", 1):
+            migration.index_existing_users(apps, mock.Mock(connection=connection))
+
+        self.assertEqual(
+            set(EmailIndex.objects.values_list("email", flat=True)),
+            {"testemail@test.com", "other@test.com"},
+        )
+
+    def test_index_created(self):
+        self.assertEqual(self.user.email_index.email, "testemail@test.com")
+
+    def test_index_updated(self):
+        self.user.email = "Other@Test.com"
+        self.user.save()
+
+        self.assertEqual(EmailIndex.objects.get(user=self.user).email, "other@test.com")
+
+    def test_other_fields_save_skipped(self):
+        self.user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=["last_login"])
+
+    def test_index_deleted_with_user(self):
+        self.user.delete()
+
+        self.assertEqual(EmailIndex.objects.count(), 0)
+
+    def test_case_insensitive_lookup(self):
+        response = self.client.post(
+            reverse("password_reset"), data={"email": "testemail@TEST.com"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+
+    def test_sign_up_email_taken_case_insensitive(self):
+        data = {
+            "username": "testUser2",
+            "email": "testemail@test.COM",
+            "password": "test2password123",
+            "password2": "test2password123",
+        }
+        response = self.client.post(reverse("sign_up"), data=data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", response.data)
+
+    def test_import_users_indexed(self):
+        rows = [{"username": "imported", "email": "Imported@Test.com"}]
+        list(services.import_users(rows, "http://testserver"))
+
+        user = User.objects.get(username="imported")
+        self.assertEqual(user.email_index.email, "imported@test.com")
+
+    def test_backfill(self):
+        other = User.objects.create_user(
+            username="testUser2", email="second@test.com", password="pass"
+        )
+        EmailIndex.objects.filter(user=self.user).delete()
+        EmailIndex.objects.filter(user=other).update(email="outdated@test.com")
+
+        out = StringIO()
+        call_command("backfill_email_index", chunk_size=1, stdout=out)
+
+        self.assertEqual(
+            dict(EmailIndex.objects.values_list("user_id", "email")),
+            {self.user.pk: "testemail@test.com", other.pk: "second@test.com"},
+        )
+        self.assertIn("Indexed 2 users", out.getvalue())
+
+    def test_backfill_time_limit(self):
+        EmailIndex.objects.all().delete()
+
+        out = StringIO()
+        call_command("backfill_email_index", max_seconds=0, stdout=out)
+
+        self.assertEqual(EmailIndex.objects.count(), 0)
+        self.assertIn("resume with --after-pk 0", out.getvalue())
+
+
+class PurgeExpiredTokensTestCase(TestCase):
+    def setUp(self) -> None:
+        for i in range(4):
+            user = User.objects.create_user(
+                username=f"testUser{i}",
+                email=f"testemail{i}@test.com",
+                password="testpassword123",
+            )
+            token = ActivationToken.objects.create(user=user)
+            token.set_up_token()
+            if i < 3:
+                token.expiration_date = timezone.now() - timezone.timedelta(seconds=5)
+            token.save()
+
+    def test_expired_tokens_deleted_in_chunks(self):
+        out = StringIO()
+        call_command("purge_expired_tokens", chunk_size=2, stdout=out)
+
+        self.assertEqual(ActivationToken.objects.count(), 1)
+        self.assertEqual(ActivationToken.objects.first().expired, False)
+        self.assertIn("Deleted 3 expired ActivationToken rows", out.getvalue())
+
+    def test_tokens_of_unactivated_users_kept(self):
+        User.objects.filter(username="testUser0").update(is_active=False)
+
+        call_command("purge_expired_tokens", stdout=StringIO())
+
+        self.assertEqual(
+            set(ActivationToken.objects.values_list("user__username", flat=True)),
+            {"testUser0", "testUser3"},
+        )
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("purge_expired_tokens", dry_run=True, stdout=out)
+
+        self.assertEqual(ActivationToken.objects.count(), 4)
+        self.assertIn("Would delete 3 expired ActivationToken rows", out.getvalue())
+
+    def test_time_limit(self):
+        call_command("purge_expired_tokens", max_seconds=0, stdout=StringIO())
+
+        self.assertEqual(ActivationToken.objects.count(), 4)
+
+
+class ExportTokensTestCase(TestCase):
+    def setUp(self) -> None:
+        now = timezone.now()
+        self.users = []
+        for i, hours in enumerate([-2, 1, 3]):
+            user = User.objects.create_user(
+                username=f"testUser{i}",
+                email=f"testemail{i}@test.com",
+                password="testpassword123",
+                is_active=False,
+            )
+            ActivationToken.objects.create(
+                user=user,
+                digest=f"digest{i}",
+                expiration_date=now + timezone.timedelta(hours=hours),
+            )
+            self.users.append(user)
+
+    def test_export_filtered_by_expiry(self):
+        rows = list(
+            services.export_tokens(
+                ActivationToken,
+                expires_after=timezone.now(),
+                expires_before=timezone.now() + timezone.timedelta(hours=2),
+            )
+        )
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(set(rows[0]), set(services.TOKEN_EXPORT_COLUMNS))
+        self.assertEqual(rows[0]["email"], "testemail1@test.com")
+        self.assertEqual(rows[0]["is_active"], False)
+        self.assertEqual(rows[0]["expired"], False)
+
+    def test_export_filtered_by_creation(self):
+        rows = services.export_tokens(
+            ActivationToken, created_before=timezone.now() - timezone.timedelta(1)
+        )
+
+        self.assertEqual(list(rows), [])
+
+    def test_export_is_lazy(self):
+        with self.assertNumQueries(0):
+            rows = services.export_tokens(ActivationToken)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(rows)), 3)
+
+    @override_settings(
+        FLASH_SETTINGS={"TOKEN_BACKEND": "flash_accounts.tokens.SignedTokenBackend"}
+    )
+    def test_signed_tokens_not_exported(self):
+        with self.assertRaises(ImproperlyConfigured):
+            services.export_tokens(ActivationToken)
+        with self.assertRaisesMessage(CommandError, "does not store tokens"):
+            call_command("export_tokens", "activation", stdout=StringIO())
+
+    def test_csv_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.csv")
+            out = StringIO()
+            call_command(
+                "export_tokens", "activation", output=path, chunk_size=2, stdout=out
+            )
+            with open(path, newline="") as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(
+            [row["username"] for row in rows], [u.username for u in self.users]
+        )
+        self.assertEqual([row["expired"] for row in rows], ["True", "False", "False"])
+        self.assertIn("Exported 3 tokens", out.getvalue())
+
+    def test_jsonl_command_to_stdout(self):
+        out, err = StringIO(), StringIO()
+        call_command(
+            "export_tokens",
+            "activation",
+            "--created-after",
+            "2000-01-01",
+            format="jsonl",
+            stdout=out,
+            stderr=err,
+        )
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row["user_id"] for row in rows], [u.pk for u in self.users])
+        self.assertIn("Exported 3 tokens", err.getvalue())
+
+    def test_view_streams_export_to_staff(self):
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        request = APIRequestFactory().get(
+            "/export/", {"kind": "activation", "file_format": "jsonl"}
+        )
+        force_authenticate(request, staff)
+
+        response = export_tokens_view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+    @override_settings(
+        FLASH_SETTINGS={"TOKEN_BACKEND": "flash_accounts.tokens.SignedTokenBackend"}
+    )
+    def test_view_rejects_signed_tokens_before_streaming(self):
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        request = APIRequestFactory().get("/export/", {"kind": "activation"})
+        force_authenticate(request, staff)
+
+        response = export_tokens_view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.streaming)
+
+    def test_view_forbidden_for_users(self):
+        request = APIRequestFactory().get("/export/", {"kind": "activation"})
+        force_authenticate(request, self.users[0])
+
+        response = export_tokens_view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@skipUnless(flash_settings.ACTIVATE_ACCOUNT, "account activation is disabled")
+class ReapUnactivatedUsersTestCase(TestCase):
+    def setUp(self) -> None:
+        now = timezone.now()
+        self.dead = []
+        for i in range(3):
+            user = User.objects.create_user(
+                username=f"deadUser{i}",
+                email=f"dead{i}@test.com",
+                is_active=False,
+            )
+            ActivationToken.objects.create(
+                user=user,
+                digest=f"dead{i}",
+                expiration_date=now - timezone.timedelta(days=8),
+            )
+            self.dead.append(user)
+        # within grace period
+        self.pending = User.objects.create_user(username="pending", is_active=False)
+        ActivationToken.objects.create(
+            user=self.pending,
+            digest="pending",
+            expiration_date=now - timezone.timedelta(days=1),
+        )
+        self.active = User.objects.create_user(username="active")
+
+    def test_users_reaped_in_chunks(self):
+        out = StringIO()
+        call_command("reap_unactivated_users", chunk_size=2, stdout=out)
+
+        self.assertEqual(
+            set(User.objects.values_list("username", flat=True)), {"pending", "active"}
+        )
+        self.assertEqual(ActivationToken.objects.count(), 1)
+        self.assertEqual(EmailIndex.objects.filter(user__in=self.dead).count(), 0)
+        self.assertIn("Deleted 3 unactivated users", out.getvalue())
+
+    def test_users_archived_before_deleted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "archive.jsonl")
+            call_command("reap_unactivated_users", archive=path, stdout=StringIO())
+            with open(path) as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual(
+            [row["username"] for row in rows], [u.username for u in self.dead]
+        )
+        self.assertEqual(rows[0]["email"], "dead0@test.com")
+
+    def test_grace_period(self):
+        call_command("reap_unactivated_users", grace_hours=12, stdout=StringIO())
+
+        self.assertEqual(
+            list(User.objects.values_list("username", flat=True)), ["active"]
+        )
+
+    def test_users_who_logged_in_kept(self):
+        User.objects.filter(pk=self.dead[0].pk).update(last_login=timezone.now())
+
+        deleted = services.reap_unactivated_users(timezone.now(), 10)
+
+        self.assertEqual(deleted, 3)
+        self.assertTrue(User.objects.filter(pk=self.dead[0].pk).exists())
+
+    def test_users_reaped_after_tokens_purged(self):
+        call_command("purge_expired_tokens", stdout=StringIO())
+        self.assertEqual(ActivationToken.objects.count(), 4)
+
+        call_command("reap_unactivated_users", stdout=StringIO())
+
+        self.assertEqual(
+            set(User.objects.values_list("username", flat=True)), {"pending", "active"}
+        )
+        self.assertEqual(ActivationToken.objects.count(), 1)
+
+    def test_users_without_token_reaped(self):
+        ActivationToken.objects.filter(user__in=self.dead).delete()
+        User.objects.filter(pk__in=[user.pk for user in self.dead]).update(
+            date_joined=timezone.now() - timezone.timedelta(days=9)
+        )
+        # joined recently
+        fresh = User.objects.create_user(username="fresh", is_active=False)
+
+        cutoff = timezone.now() - timezone.timedelta(days=7)
+        deleted = services.reap_unactivated_users(cutoff, 10)
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(
+            set(User.objects.values_list("username", flat=True)),
+            {"pending", "active", "fresh"},
+        )
+        self.assertTrue(User.objects.filter(pk=fresh.pk).exists())
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("reap_unactivated_users", dry_run=True, stdout=out)
+
+        self.assertEqual(User.objects.count(), 5)
+        self.assertIn("Would delete 3 unactivated users", out.getvalue())
+
+    def test_time_limit(self):
+        call_command("reap_unactivated_users", max_seconds=0, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 5)
+
+
+@skipUnless(flash_settings.ACTIVATE_ACCOUNT, "account activation is disabled")
+class CampaignTestCase(TestCase):
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(
+                username=f"<testUser{i}>",
+                email=f"testemail{i}@test.com",
+                is_active=False,
+            )
+            for i in range(3)
+        ]
+        self.token = ActivationToken(user=self.users[0])
+        self.token.set_up_token()
+        self.token.save()
+
+    def send(self, **kwargs):
+        return list(
+            services.send_campaign(
+                self.users,
+                flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+                "Reminder",
+                "http://testserver/",
+                **kwargs,
+            )
+        )
+
+    def test_emails_personalized(self):
+        self.assertEqual(self.send(batch_size=2), [(2, 0), (1, 0)])
+
+        self.assertEqual(len(mail.outbox), 3)
+        for user, msg in zip(self.users, mail.outbox):
+            context = {"username": user.username, "url": "http://testserver"}
+            context["host"] = "testserver"
+            self.assertEqual(msg.to, [user.email])
+            self.assertEqual(msg.subject, "Reminder")
+            self.assertEqual(
+                (msg.body, msg.alternatives[0][0]),
+                email_templates.render(
+                    flash_settings.ACTIVATION_EMAIL_TEMPLATE, context
+                ),
+            )
+
+    def test_rendered_once_per_context(self):
+        with mock.patch.object(
+            email_templates, "personalize", wraps=email_templates.personalize
+        ) as personalize:
+            self.send(get_context=lambda user: {"odd": user.pk % 2})
+
+        self.assertEqual(personalize.call_count, 2)
+
+    def test_tokens_issued_in_bulk(self):
+        self.send(token_class_name=ActivationToken)
+
+        self.assertEqual(ActivationToken.objects.count(), 3)
+        self.assertNotEqual(
+            ActivationToken.objects.get(user=self.users[0]).digest, self.token.digest
+        )
+        for user, msg in zip(self.users, mail.outbox):
+            token_value = get_token_from_email(msg)
+            url = reverse("activate", kwargs={"token_value": token_value})
+            self.assertIn(f"http://testserver{url}", msg.body)
+            self.assertEqual(
+                ActivationToken.objects.get(
+                    digest=ActivationToken.hash_token(token_value)
+                ).user,
+                user,
+            )
+
+    def test_batch_takes_constant_queries(self):
+        users = [User(username=f"new{i}", email=f"new{i}@test.com") for i in range(4)]
+        User.objects.bulk_create(users)
+        self.users = list(User.objects.order_by("pk"))
+
+        # savepoint, token select, insert, update and savepoint release
+        with self.assertNumQueries(5):
+            self.send(token_class_name=ActivationToken)
+
+    @override_settings(FLASH_SETTINGS={"EMAIL_OUTBOX": True})
+    def test_emails_stored_in_outbox(self):
+        self.assertEqual(self.send(), [(3, 0)])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "send_campaign",
+            flash_settings.ACTIVATION_EMAIL_TEMPLATE,
+            "--context",
+            "host=example.com",
+            subject="Reminder",
+            base_url="http://testserver",
+            token="activation",
+            users="inactive",
+            stdout=out,
+        )
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn("example.com Team", mail.outbox[0].body)
+        self.assertIn("Sent 3 emails, 0 failed", out.getvalue())
+        self.assertIn("messages/s", out.getvalue())
+
+
+class BulkSendTestCase(TestCase):
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(
+                username=f"testUser{i}",
+                email=f"testemail{i}@test.com",
+                password="testpassword123",
+            )
+            for i in range(3)
+        ]
+        self.request = RequestFactory().get("/")
+
+    def test_emails_sent_over_one_connection(self):
+        with mock.patch.object(
+            services, "get_connection", wraps=services.get_connection
+        ) as get_connection:
+            results = services.bulk_create_and_send_activation_tokens(
+                self.users, self.request, batch_size=2
+            )
+
+        get_connection.assert_called_once()
+        self.assertEqual(results, [(user, None) for user in self.users])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(ActivationToken.objects.count(), 3)
+        self.assertEqual(
+            [msg.to[0] for msg in mail.outbox], [user.email for user in self.users]
+        )
+
+    def test_failures_reported_per_message(self):
+        error = OSError("refused")
+        with mock.patch.object(
+            mail.EmailMultiAlternatives, "send", side_effect=[1, error, 1]
+        ):
+            results = services.bulk_create_and_send_password_reset_tokens(
+                self.users, self.request
+            )
+
+        self.assertEqual(
+            results,
+            [(self.users[0], None), (self.users[1], error), (self.users[2], None)],
+        )
+        self.assertEqual(PasswordResetToken.objects.count(), 3)
+
+    @override_settings(FLASH_SETTINGS={"EMAIL_OUTBOX": True})
+    def test_emails_stored_in_outbox(self):
+        results = services.bulk_create_and_send_activation_tokens(
+            self.users, self.request
+        )
+
+        self.assertEqual(results, [(user, None) for user in self.users])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+
+class ImportUsersTestCase(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user(
+            username="existingUser",
+            email="existing@test.com",
+            password="testpassword123",
+        )
+        self.rows = [
+            {"username": "testUser0", "email": "testemail0@test.com"},
+            {"username": "testUser1", "email": "testemail1@test.com"},
+            {"username": "testUser2", "email": "existing@test.com"},
+            {"username": "testUser3", "email": ""},
+            {
+                "username": "testUser4",
+                "email": "testemail4@test.com",
+                "password": "testpassword123",
+            },
+        ]
+
+    def write_file(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_users_in_batches(self):
+        results = list(
+            services.import_users(self.rows, "http://testserver", batch_size=2)
+        )
+
+        self.assertEqual(results, [(2, 0, 0), (0, 2, 0), (1, 0, 0)])
+        self.assertEqual(User.objects.count(), 4)
+        self.assertTrue(
+            User.objects.get(username="testUser4").check_password("testpassword123")
+        )
+        self.assertFalse(User.objects.get(username="testUser0").has_usable_password())
+
+        if flash_settings.ACTIVATE_ACCOUNT:
+            self.assertEqual(ActivationToken.objects.count(), 3)
+            self.assertEqual(len(mail.outbox), 3)
+            self.assertFalse(User.objects.get(username="testUser0").is_active)
+
+            url = reverse(
+                "activate", kwargs={"token_value": get_token_from_email(mail.outbox[0])}
+            )
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_import_csv_command(self):
+        content = "username,email,password\n"
+        content += "".join(
+            f"{row['username']},{row['email']},{row.get('password', '')}\n"
+            for row in self.rows
+        )
+        path = self.write_file(".csv", content)
+
+        out = StringIO()
+        call_command("import_users", path, base_url="http://testserver", stdout=out)
+
+        self.assertEqual(User.objects.count(), 4)
+        self.assertIn("Created 3 users, skipped 2", out.getvalue())
+
+    def test_import_jsonl_command(self):
+        content = "".join(json.dumps(row) + "\n" for row in self.rows)
+        path = self.write_file(".jsonl", content)
+
+        call_command(
+            "import_users", path, base_url="http://testserver", stdout=StringIO()
+        )
+
+        self.assertEqual(User.objects.count(), 4)
+
+
+@override_settings(FLASH_SETTINGS={"EMAIL_OUTBOX": True})
+class EmailOutboxTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.url = reverse("password_reset")
+        self.valid_data = {"email": "testemail@test.com"}
+
+    def test_email_stored_in_outbox(self):
+        response = self.client.post(self.url, data=self.valid_data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+        email = OutboxEmail.objects.first()
+        self.assertEqual(email.to_email, "testemail@test.com")
+        self.assertEqual(email.subject, flash_settings.PASSWORD_RESET_EMAIL_SUBJECT)
+        self.assertEqual(email.sent_at, None)
+
+    def test_outbox_emails_sent_once(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        self.assertEqual(services.send_outbox_emails(), (1, 0))
+        self.assertEqual(services.send_outbox_emails(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+        email = OutboxEmail.objects.first()
+        self.assertNotEqual(email.sent_at, None)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(mail.outbox[0].body, email.text_content)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], email.html_content)
+
+    def test_claimed_emails_not_claimed_again(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        self.assertEqual(len(services.claim_outbox_emails(10)), 1)
+        self.assertEqual(len(services.claim_outbox_emails(10)), 0)
+
+    def test_failed_email_retried_with_backoff(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        with mock.patch.object(
+            mail.EmailMultiAlternatives, "send", side_effect=OSError("refused")
+        ):
+            self.assertEqual(services.send_outbox_emails(), (0, 1))
+
+        email = OutboxEmail.objects.first()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.sent_at, None)
+        self.assertIn("refused", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        email.next_attempt_at = timezone.now()
+        email.save()
+        self.assertEqual(services.send_outbox_emails(), (1, 0))
+
+    def test_connection_failure_retried_with_backoff(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        with mock.patch("flash_accounts.services.get_connection") as get_connection:
+            get_connection.return_value.open.side_effect = ConnectionRefusedError
+            self.assertEqual(services.send_outbox_emails(), (0, 1))
+
+        email = OutboxEmail.objects.first()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("ConnectionRefusedError", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(
+        FLASH_SETTINGS={
+            "EMAIL_OUTBOX": True,
+            "EMAIL_OUTBOX_CLAIM_TIMEOUT": timezone.timedelta(0),
+        }
+    )
+    def test_emails_not_sent_after_claim_expires(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        self.assertEqual(services.send_outbox_emails(), (0, 0))
+
+        email = OutboxEmail.objects.first()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(email.attempts, 0)
+        self.assertLessEqual(email.next_attempt_at, timezone.now())
+
+    def test_email_not_retried_after_max_attempts(self):
+        self.client.post(self.url, data=self.valid_data)
+        OutboxEmail.objects.update(attempts=flash_settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+
+        self.assertEqual(services.send_outbox_emails(), (0, 0))
+
+    def test_send_outbox_emails_command(self):
+        self.client.post(self.url, data=self.valid_data)
+
+        call_command("send_outbox_emails", stdout=mock.Mock())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(
+    FLASH_SETTINGS={"TOKEN_BACKEND": "flash_accounts.tokens.SignedTokenBackend"}
+)
+class SignedTokenBackendTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.valid_data = {
+            "password": "newtestpassWORD##1",
+            "password2": "newtestpassWORD##1",
+        }
+
+    def get_token(self):
+        return re.search(r"confirm/([^/\s]+)/", mail.outbox[-1].body).group(1)
+
+    def test_password_reset(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        self.assertEqual(PasswordResetToken.objects.count(), 0)
+
+        url = reverse(
+            "password_reset_confirm", kwargs={"token_value": self.get_token()}
+        )
+        # user select and user update
+        with self.assertNumQueries(2):
+            response = self.client.post(url, data=self.valid_data)
+
+        self.user.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.user.check_password("newtestpassWORD##1"), True)
+
+    def test_token_used_once(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        url = reverse(
+            "password_reset_confirm", kwargs={"token_value": self.get_token()}
+        )
+
+        self.client.post(url, data=self.valid_data)
+        response = self.client.post(url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_token(self):
+        backend = SignedTokenBackend()
+        token = backend.create_token(PasswordResetToken, self.user)
+
+        for token_value in ("invalidTOKEN123", token[:-1] + "x", "a.b.c"):
+            url = reverse("password_reset_confirm", kwargs={"token_value": token_value})
+            response = self.client.post(url, data=self.valid_data)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_token(self):
+        backend = SignedTokenBackend()
+        lifetime = int(flash_settings.PASSWORD_RESET_TOKEN_LIFETIME.total_seconds())
+        with mock.patch.object(
+            SignedTokenBackend, "now", return_value=backend.now() - lifetime - 5
+        ):
+            token = backend.create_token(PasswordResetToken, self.user)
+
+        url = reverse("password_reset_confirm", kwargs={"token_value": token})
+        response = self.client.post(url, data=self.valid_data)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"token": "token has expired."})
+
+    def test_token_valid_after_secret_key_rotation(self):
+        token = SignedTokenBackend().create_token(PasswordResetToken, self.user)
+        url = reverse("password_reset_confirm", kwargs={"token_value": token})
+
+        with override_settings(SECRET_KEY="new-secret-key"):
+            response = self.client.post(url, data=self.valid_data)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with override_settings(
+            SECRET_KEY="new-secret-key", SECRET_KEY_FALLBACKS=[settings.SECRET_KEY]
+        ):
+            response = self.client.post(url, data=self.valid_data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_activation_token_bound_to_is_active(self):
+        self.user.is_active = False
+        self.user.save()
+        token = SignedTokenBackend().create_token(ActivationToken, self.user)
+        url = reverse("activate", kwargs={"token_value": token})
+
+        if flash_settings.ACTIVATE_ACCOUNT:
+            response = self.client.get(url)
+            self.user.refresh_from_db()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.user.is_active, True)
+            self.assertEqual(ActivationToken.objects.count(), 0)
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(
+    FLASH_SETTINGS={"TOKEN_BACKEND": "flash_accounts.tokens.UnifiedTokenBackend"}
+)
+class UnifiedTokenBackendTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.valid_data = {
+            "password": "newtestpassWORD##1",
+            "password2": "newtestpassWORD##1",
+        }
+
+    def test_password_reset(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        token = Token.objects.get()
+        self.assertEqual(token.kind, TokenKind.PASSWORD_RESET)
+        self.assertEqual(PasswordResetToken.objects.count(), 0)
+
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": get_token_from_email(mail.outbox[-1])},
+        )
+        # token select, token delete and user update, plus savepoint
+        # and release of the transaction nested in the test one
+        with self.assertNumQueries(5):
+            response = self.client.post(url, data=self.valid_data)
+
+        self.user.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.user.check_password("newtestpassWORD##1"), True)
+        self.assertEqual(Token.objects.count(), 0)
+
+    def test_one_token_per_kind(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        token = Token.objects.get()
+
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": get_token_from_email(mail.outbox[0])},
+        )
+        response = self.client.post(url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(token.digest, Token.objects.get().digest)
+
+    def test_kinds_not_interchangeable(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        token_value = get_token_from_email(mail.outbox[-1])
+
+        if flash_settings.ACTIVATE_ACCOUNT:
+            response = self.client.get(
+                reverse("activate", kwargs={"token_value": token_value})
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_token(self):
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        Token.objects.update(expiration_date=timezone.now())
+
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": get_token_from_email(mail.outbox[-1])},
+        )
+        response = self.client.post(url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_tokens_purged_by_kind(self):
+        for kind in TokenKind:
+            token = Token(kind=kind, user=self.user)
+            token.set_up_token()
+            token.expiration_date = timezone.now() - timezone.timedelta(seconds=5)
+            token.save()
+
+        out = StringIO()
+        call_command("purge_expired_tokens", stdout=out)
+
+        self.assertEqual(Token.objects.count(), 0)
+        self.assertIn("Deleted 1 expired Token (activation) rows", out.getvalue())
+        self.assertIn("Deleted 1 expired Token (password_reset) rows", out.getvalue())
+
+    def test_tokens_moved_to_unified_table(self):
+        token = PasswordResetToken(user=self.user)
+        token.set_up_token()
+        token.save()
+
+        out = StringIO()
+        call_command("move_tokens_to_unified_table", stdout=out)
+
+        moved = Token.objects.get()
+        self.assertEqual(moved.kind, TokenKind.PASSWORD_RESET)
+        self.assertEqual(moved.digest, token.digest)
+        self.assertEqual(PasswordResetToken.objects.count(), 0)
+        self.assertIn("Moved 1 PasswordResetToken rows", out.getvalue())
+
+        url = reverse("password_reset_confirm", kwargs={"token_value": token.token})
+        response = self.client.post(url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_newer_unified_token_kept_on_move(self):
+        token = PasswordResetToken(user=self.user)
+        token.set_up_token()
+        token.save()
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        digest = Token.objects.get().digest
+
+        moved = services.move_tokens_to_unified_table(PasswordResetToken, 10)
+
+        self.assertEqual(moved, 1)
+        self.assertEqual(Token.objects.get().digest, digest)
+        self.assertEqual(PasswordResetToken.objects.count(), 0)
+
+    @override_settings(FLASH_SETTINGS={})
+    def test_move_requires_unified_backend(self):
+        with self.assertRaisesMessage(CommandError, "UnifiedTokenBackend"):
+            call_command("move_tokens_to_unified_table", stdout=StringIO())
+
+
+@skipUnless("replica" in settings.DATABASES, "requires 'replica' database alias")
+@override_settings(
+    DATABASE_ROUTERS=["flash_accounts.routers.PrimaryReplicaRouter"],
+    FLASH_SETTINGS={"REPLICA_DATABASE": "replica"},
+)
+class DatabaseRoutingTestCase(APITestCase):
+    """
+    Primary and replica are separate databases here, rows are copied
+    to replica by `replicate` method.
+    """
+
+    # test runner collects databases of skipped classes too
+    databases = (
+        {"default", "replica"} if "replica" in settings.DATABASES else {"default"}
+    )
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+            is_active=False,
+        )
+        self.valid_data = {
+            "password": "newtestpassWORD##1",
+            "password2": "newtestpassWORD##1",
+        }
+
+    def replicate(self):
+        for model in (User, EmailIndex, ActivationToken, PasswordResetToken):
+            model.objects.using("replica").all().delete()
+            model.objects.using("replica").bulk_create(
+                model.objects.using("default").all()
+            )
+
+    def test_unknown_token_read_from_replica(self):
+        url = reverse("password_reset_confirm", kwargs={"token_value": "invalid"})
+
+        with self.assertNumQueries(0, using="default"):
+            with self.assertNumQueries(1, using="replica"):
+                response = self.client.post(url, data=self.valid_data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_looked_up_on_replica(self):
+        # user is not replicated yet
+        response = self.client.post(
+            reverse("password_reset"), data={"email": self.user.email}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_token_consumed_on_primary(self):
+        self.replicate()
+        self.client.post(reverse("password_reset"), data={"email": self.user.email})
+        self.assertEqual(PasswordResetToken.objects.using("default").count(), 1)
+        self.assertEqual(PasswordResetToken.objects.using("replica").count(), 0)
+
+        self.replicate()
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": get_token_from_email(mail.outbox[-1])},
+        )
+        # token select
+        with self.assertNumQueries(1, using="replica"):
+            response = self.client.post(url, data=self.valid_data)
+
+        self.user.refresh_from_db(using="default")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.user.check_password("newtestpassWORD##1"), True)
+        self.assertEqual(PasswordResetToken.objects.using("default").count(), 0)
+
+    def test_resend_checks_replica(self):
+        self.replicate()
+        User.objects.using("replica").update(is_active=True)
+
+        response = self.client.post(
+            reverse("activate_resend"), data={"email": self.user.email}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ActivationToken.objects.using("default").count(), 0)
+
+    def test_resend_writes_to_primary(self):
+        self.replicate()
+
+        response = self.client.post(
+            reverse("activate_resend"), data={"email": self.user.email}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ActivationToken.objects.using("default").count(), 1)
+        self.assertEqual(ActivationToken.objects.using("replica").count(), 0)
+
+    def test_sign_up_writes_to_primary(self):
+        data = {
+            "username": "testUser2",
+            "email": "testemail2@test.com",
+            "password": "test2password123",
+            "password2": "test2password123",
+        }
+        response = self.client.post(reverse("sign_up"), data=data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.using("default").count(), 2)
+        self.assertEqual(User.objects.using("replica").count(), 0)
+        self.assertEqual(EmailIndex.objects.using("default").count(), 2)
+
+
+@override_settings(ROOT_URLCONF="flash_accounts.async_urls")
+class AsyncViewsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="testUser",
+            email="testemail@test.com",
+            password="testpassword123",
+        )
+        self.new_password_data = {
+            "password": "newtestpassWORD##1",
+            "password2": "newtestpassWORD##1",
+        }
+
+    async def test_sign_up(self):
+        data = {
+            "username": "testUser2",
+            "email": "testemail2@test.com",
+            "password": "testpassword123",
+            "password2": "testpassword123",
+        }
+        response = await self.async_client.post(
+            reverse("sign_up"), data, content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.json(), {"username": "testUser2", "email": "testemail2@test.com"}
+        )
+        user = await User.objects.aget(username="testUser2")
+        self.assertEqual(user.check_password("testpassword123"), True)
+
+        response = await self.async_client.post(
+            reverse("sign_up"), data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_password_reset(self):
+        response = await self.async_client.post(
+            reverse("password_reset"),
+            {"email": "testemail@test.com"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 1)
+
+        url = reverse(
+            "password_reset_confirm",
+            kwargs={"token_value": get_token_from_email(mail.outbox[0])},
+        )
+        response = await self.async_client.post(
+            url, self.new_password_data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"password": "Password has been changed."})
+
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.check_password("newtestpassWORD##1"), True)
+
+        response = await self.async_client.post(
+            url, self.new_password_data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_invalid_token_not_hashing_password(self):
+        url = reverse("password_reset_confirm", kwargs={"token_value": "invalid"})
+        with mock.patch("flash_accounts.services.make_password") as make_password:
+            response = await self.async_client.post(
+                url, self.new_password_data, content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        make_password.assert_not_called()
+
+    @override_settings(FLASH_SETTINGS={"THROTTLE_EMAIL_RATE": "2/hour"})
+    async def test_email_throttle_ignores_list_body(self):
+        response = await self.async_client.post(
+            reverse("password_reset"),
+            [{"email": "testemail@test.com"}],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_email_not_exist(self):
+        response = await self.async_client.post(
+            reverse("password_reset"),
+            {"email": "t35tem4il@test.com"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_method_not_allowed(self):
+        response = await self.async_client.get(reverse("password_reset"))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    if flash_settings.ACTIVATE_ACCOUNT:
+
+        async def test_activate_account(self):
+            self.user.is_active = False
+            await self.user.asave()
+
+            response = await self.async_client.post(
+                reverse("activate_resend"),
+                {"email": "testemail@test.com"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            url = reverse(
+                "activate", kwargs={"token_value": get_token_from_email(mail.outbox[0])}
+            )
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), {"account": "Account activated."})
+
+            await self.user.arefresh_from_db()
+            self.assertEqual(self.user.is_active, True)
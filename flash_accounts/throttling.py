@@ -0,0 +1,53 @@
+from rest_framework.throttling import SimpleRateThrottle
+
+from .settings import flash_settings
+
+import hashlib
+
+
+class FlashRateThrottle(SimpleRateThrottle):
+    """
+    Base class for throttles, which rates are declared in app settings.
+    Empty rate disables throttling.
+    """
+
+    setting = None
+
+    def get_rate(self):
+        return getattr(flash_settings, self.setting) or None
+
+
+class IPRateThrottle(FlashRateThrottle):
+    """
+    Limits requests made from a single IP address.
+    """
+
+    scope = "flash_accounts_ip"
+    setting = "THROTTLE_IP_RATE"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": self.get_ident(request),
+        }
+
+
+class EmailRateThrottle(FlashRateThrottle):
+    """
+    Limits requests made for a single email address.
+    """
+
+    scope = "flash_accounts_email"
+    setting = "THROTTLE_EMAIL_RATE"
+
+    def get_cache_key(self, request, view):
+        # JSON body may be a list or a scalar
+        if not isinstance(request.data, dict):
+            return None
+        email = request.data.get("email")
+        if not isinstance(email, str) or not email:
+            return None
+
+        # email may contain characters not allowed in cache keys
+        ident = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {"scope": self.scope, "ident": ident}
@@ -0,0 +1,144 @@
+from django.core.cache import caches
+from django.db import transaction
+
+from .settings import flash_settings
+from . import metrics
+
+
+class TokenCache:
+    """
+    Read-through cache of token rows, keyed by token digest.
+
+    Tokens which do not exist are cached for a shorter time, so link
+    scanners and bogus links do not reach the database either.
+    Caching is disabled when `TOKEN_CACHE` setting is empty.
+    """
+
+    key_prefix = "flash_accounts.token"
+    # cached value of a token which does not exist
+    missing = {}
+
+    @property
+    def enabled(self):
+        return bool(flash_settings.TOKEN_CACHE)
+
+    @property
+    def cache(self):
+        return caches[flash_settings.TOKEN_CACHE]
+
+    def make_key(self, token_class_name, digest):
+        return f"{self.key_prefix}.{token_class_name.__name__}.{digest}"
+
+    def make_entry(self, token):
+        """
+        Returns value and timeout of cache entry for given token row.
+        """
+
+        if token is None:
+            return self.missing, flash_settings.TOKEN_CACHE_MISS_TIMEOUT
+        return token, flash_settings.TOKEN_CACHE_TIMEOUT
+
+    def get(self, token_class_name, digest):
+        """
+        Returns cached token row, `missing` for unknown token
+        or `None` if token is not cached.
+        """
+
+        if not self.enabled:
+            return None
+
+        token = self.cache.get(self.make_key(token_class_name, digest))
+        metrics.increment("token_cache_miss" if token is None else "token_cache_hit")
+        return token
+
+    def set(self, token_class_name, digest, token):
+        """
+        Cache token row, `None` marks token as unknown.
+        """
+
+        if not self.enabled:
+            return
+
+        value, timeout = self.make_entry(token)
+        key = self.make_key(token_class_name, digest)
+        self.cache.set(key, value, timeout.total_seconds())
+
+    def invalidate(self, token_class_name, digest, using=None):
+        """
+        Remove token from cache right away and mark it as unknown
+        once current transaction of `using` database is committed.
+        """
+
+        if not self.enabled:
+            return
+
+        self.cache.delete(self.make_key(token_class_name, digest))
+        transaction.on_commit(
+            lambda: self.set(token_class_name, digest, None), using=using
+        )
+
+    def invalidate_many(self, token_class_name, digests, using=None):
+        """
+        Bulk version of `invalidate`.
+        """
+
+        if not self.enabled:
+            return
+
+        keys = [self.make_key(token_class_name, digest) for digest in digests]
+        self.cache.delete_many(keys)
+        value, timeout = self.make_entry(None)
+        transaction.on_commit(
+            lambda: self.cache.set_many(
+                dict.fromkeys(keys, value), timeout.total_seconds()
+            ),
+            using=using,
+        )
+
+    def discard_many(self, token_class_name, digests, using=None):
+        """
+        Remove tokens from cache once current transaction of `using`
+        database is committed, so their changed rows are read again.
+        """
+
+        if not self.enabled:
+            return
+
+        keys = [self.make_key(token_class_name, digest) for digest in digests]
+        transaction.on_commit(lambda: self.cache.delete_many(keys), using=using)
+
+    async def aget(self, token_class_name, digest):
+        """
+        Async version of `get`.
+        """
+
+        if not self.enabled:
+            return None
+
+        token = await self.cache.aget(self.make_key(token_class_name, digest))
+        metrics.increment("token_cache_miss" if token is None else "token_cache_hit")
+        return token
+
+    async def aset(self, token_class_name, digest, token):
+        """
+        Async version of `set`.
+        """
+
+        if not self.enabled:
+            return
+
+        value, timeout = self.make_entry(token)
+        key = self.make_key(token_class_name, digest)
+        await self.cache.aset(key, value, timeout.total_seconds())
+
+    async def ainvalidate(self, token_class_name, digest):
+        """
+        Async version of `invalidate`.
+        Async queries run outside of transactions, so token is marked
+        as unknown right away.
+        """
+
+        await self.aset(token_class_name, digest, None)
+
+
+token_cache = TokenCache()
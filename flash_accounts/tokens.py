@@ -0,0 +1,561 @@
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import base36_to_int, int_to_base36
+from django.core.exceptions import ValidationError
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.encoding import force_bytes
+from django.contrib.auth import get_user_model
+from django.utils.module_loading import import_string
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+from django.conf import settings
+
+from .models import Token, get_token_lifetime
+from .routers import get_read_database, get_write_database
+from .token_cache import token_cache
+from .settings import flash_settings
+
+from datetime import datetime, date
+
+User = get_user_model()
+
+
+class TokenExpiredError(Exception):
+    """
+    Raised when consumed token has expired.
+    """
+
+
+def get_token_backend():
+    """
+    Returns instance of token backend declared in `TOKEN_BACKEND` setting.
+    """
+
+    return import_string(flash_settings.TOKEN_BACKEND)()
+
+
+class ModelTokenBackend:
+    """
+    Stores tokens in `ActivationToken` and `PasswordResetToken` tables.
+
+    Token lookups are served from cache declared in `TOKEN_CACHE` setting,
+    if it is enabled, otherwise from `REPLICA_DATABASE` if it is configured.
+    Tokens are written to `PRIMARY_DATABASE`, unless other alias is passed
+    with `using`.
+    """
+
+    token_fields = ["pk", "user_id", "expiration_date"]
+
+    def token_lookup(self, token_class_name):
+        """
+        Returns model storing given class name tokens
+        and field values selecting them.
+        """
+
+        return token_class_name, {}
+
+    def create_token(
+        self, token_class_name, user, new_user=False, using=None, cooldown=None
+    ):
+        """
+        Create and set-up given class name token, returns its value.
+        Token of a new user is inserted without checking for existing one.
+
+        Existing token is reissued only if it was not changed concurrently
+        and, with `cooldown` given, if it was issued at least `cooldown` ago.
+        Otherwise it is kept untouched and `None` is returned.
+        Reissued token is removed from cache.
+        """
+
+        using = using or get_write_database()
+        model, lookup = self.token_lookup(token_class_name)
+        if new_user:
+            token = model(user=user, **lookup)
+            token.set_up_token()
+            token.save(using=using)
+            return token.token
+
+        token, created = model.objects.using(using).get_or_create(user=user, **lookup)
+        if created:
+            token.set_up_token()
+            token.save(using=using)
+            return token.token
+
+        if cooldown and token.issued_within(cooldown):
+            return None
+        if not self.reissue_token(token_class_name, token, using):
+            return None
+        return token.token
+
+    def reissue_token(self, token_class_name, token, using):
+        """
+        Set up existing token again and save it, unless it was changed
+        concurrently. Returns `True` if token was saved.
+        """
+
+        old_digest, old_expiration_date = token.digest, token.expiration_date
+        token.set_up_token()
+        updated = (
+            token.__class__.objects.using(using)
+            .filter(pk=token.pk, expiration_date=old_expiration_date)
+            .update(
+                digest=token.digest,
+                expiration_date=token.expiration_date,
+                updated_at=date.today(),
+            )
+        )
+        if updated and old_digest:
+            token_cache.invalidate(token_class_name, old_digest, using)
+        return bool(updated)
+
+    def create_tokens(self, token_class_name, users, using=None):
+        """
+        Create tokens for many new users at once, returns their values.
+        """
+
+        using = using or get_write_database()
+        model, lookup = self.token_lookup(token_class_name)
+        tokens = [model(user=user, **lookup) for user in users]
+        for token in tokens:
+            token.set_up_token()
+        model.objects.using(using).bulk_create(tokens)
+        return [token.token for token in tokens]
+
+    def issue_tokens(self, token_class_name, users, using=None):
+        """
+        Create or reissue tokens of many existing users at once,
+        returns their values in order of users. Takes one query
+        and at most one insert and one update statement.
+        Reissued tokens are removed from cache.
+        """
+
+        using = using or get_write_database()
+        model, lookup = self.token_lookup(token_class_name)
+        existing = {
+            token.user_id: token
+            for token in model.objects.using(using).filter(user__in=users, **lookup)
+        }
+        old_digests = [token.digest for token in existing.values() if token.digest]
+
+        tokens, created = [], []
+        for user in users:
+            token = existing.get(user.pk)
+            if token is None:
+                token = model(user=user, **lookup)
+                created.append(token)
+            token.set_up_token()
+            token.updated_at = date.today()
+            tokens.append(token)
+
+        model.objects.using(using).bulk_create(created)
+        model.objects.using(using).bulk_update(
+            existing.values(), ["digest", "expiration_date", "updated_at"]
+        )
+        token_cache.invalidate_many(token_class_name, old_digests, using)
+        return [token.token for token in tokens]
+
+    def consume_token(
+        self, token_class_name, token_value, using=None, validated=None, **user_fields
+    ):
+        """
+        Delete valid token and update given fields of its user in one
+        transaction. Returns id of the user.
+
+        Takes three statements: token select, filtered token delete
+        and user update. Digest and expiry are checked again by the delete,
+        so a token can be consumed only once, even by concurrent requests
+        or when its row was read from cache or replica. Unknown and expired
+        tokens read from cache take no statements, those read from replica
+        take no statements on primary. Token select is skipped, when
+        token returned by `validate_token` is passed as `validated`.
+
+        Raises `Http404` if token does not exist and `TokenExpiredError`
+        if token has expired.
+        """
+
+        digest = token_class_name.hash_token(token_value)
+        now = timezone.now()
+
+        token = validated or self.validate_token(token_class_name, token_value)
+
+        using = using or get_write_database()
+        model, _ = self.token_lookup(token_class_name)
+        with transaction.atomic(using=using):
+            deleted, _ = (
+                model.objects.using(using)
+                .filter(pk=token["pk"], digest=digest, expiration_date__gte=now)
+                .delete()
+            )
+            token_cache.invalidate(token_class_name, digest, using)
+            # token was consumed by concurrent request
+            if not deleted:
+                raise Http404
+
+            User.objects.using(using).filter(pk=token["user_id"]).update(**user_fields)
+
+        return token["user_id"]
+
+    def validate_token(self, token_class_name, token_value, using=None):
+        """
+        Returns row of valid token, read like by `get_token`, so expensive
+        work can be skipped for invalid tokens before `consume_token`.
+
+        Raises `Http404` if token does not exist and `TokenExpiredError`
+        if token has expired.
+        """
+
+        digest = token_class_name.hash_token(token_value)
+        token = self.get_token(token_class_name, digest, using)
+        self.check_token(token, timezone.now())
+        return token
+
+    def get_token(self, token_class_name, digest, using=None):
+        """
+        Returns token row with given digest, read from cache if possible,
+        or `None` if token does not exist. Database is read from replica,
+        unless other alias is passed with `using`.
+        """
+
+        token = token_cache.get(token_class_name, digest)
+        if token is not None:
+            return token or None
+
+        using = using or get_read_database()
+        model, lookup = self.token_lookup(token_class_name)
+        token = (
+            model.objects.using(using)
+            .filter(digest=digest, **lookup)
+            .values(*self.token_fields)
+            .first()
+        )
+        token_cache.set(token_class_name, digest, token)
+        return token
+
+    async def acreate_token(
+        self, token_class_name, user, new_user=False, using=None, cooldown=None
+    ):
+        """
+        Async version of `create_token`.
+        """
+
+        using = using or get_write_database()
+        model, lookup = self.token_lookup(token_class_name)
+        if new_user:
+            token = model(user=user, **lookup)
+            token.set_up_token()
+            await token.asave(using=using)
+            return token.token
+
+        token, created = await model.objects.using(using).aget_or_create(
+            user=user, **lookup
+        )
+        if created:
+            token.set_up_token()
+            await token.asave(using=using)
+            return token.token
+
+        if cooldown and token.issued_within(cooldown):
+            return None
+        if not await self.areissue_token(token_class_name, token, using):
+            return None
+        return token.token
+
+    async def areissue_token(self, token_class_name, token, using):
+        """
+        Async version of `reissue_token`.
+        """
+
+        old_digest, old_expiration_date = token.digest, token.expiration_date
+        token.set_up_token()
+        updated = (
+            await token.__class__.objects.using(using)
+            .filter(pk=token.pk, expiration_date=old_expiration_date)
+            .aupdate(
+                digest=token.digest,
+                expiration_date=token.expiration_date,
+                updated_at=date.today(),
+            )
+        )
+        if updated and old_digest:
+            await token_cache.ainvalidate(token_class_name, old_digest)
+        return bool(updated)
+
+    async def aconsume_token(
+        self, token_class_name, token_value, using=None, validated=None, **user_fields
+    ):
+        """
+        Async version of `consume_token`.
+
+        Async queries cannot share a transaction, so the user is updated
+        after the token is deleted. The filtered delete still guarantees
+        that a token is consumed only once.
+        """
+
+        digest = token_class_name.hash_token(token_value)
+        now = timezone.now()
+
+        token = validated or await self.avalidate_token(token_class_name, token_value)
+
+        using = using or get_write_database()
+        model, _ = self.token_lookup(token_class_name)
+        deleted, _ = (
+            await model.objects.using(using)
+            .filter(pk=token["pk"], digest=digest, expiration_date__gte=now)
+            .adelete()
+        )
+        await token_cache.ainvalidate(token_class_name, digest)
+        # token was consumed by concurrent request
+        if not deleted:
+            raise Http404
+
+        await User.objects.using(using).filter(pk=token["user_id"]).aupdate(
+            **user_fields
+        )
+        return token["user_id"]
+
+    async def avalidate_token(self, token_class_name, token_value, using=None):
+        """
+        Async version of `validate_token`.
+        """
+
+        digest = token_class_name.hash_token(token_value)
+        token = await self.aget_token(token_class_name, digest, using)
+        self.check_token(token, timezone.now())
+        return token
+
+    async def aget_token(self, token_class_name, digest, using=None):
+        """
+        Async version of `get_token`.
+        """
+
+        token = await token_cache.aget(token_class_name, digest)
+        if token is not None:
+            return token or None
+
+        using = using or get_read_database()
+        model, lookup = self.token_lookup(token_class_name)
+        token = (
+            await model.objects.using(using)
+            .filter(digest=digest, **lookup)
+            .values(*self.token_fields)
+            .afirst()
+        )
+        await token_cache.aset(token_class_name, digest, token)
+        return token
+
+    def check_token(self, token, now):
+        """
+        Raises `Http404` if token was not found
+        and `TokenExpiredError` if token has expired.
+        """
+
+        if token is None:
+            raise Http404
+        if token["expiration_date"] < now:
+            raise TokenExpiredError
+
+
+class UnifiedTokenBackend(ModelTokenBackend):
+    """
+    Stores tokens of all kinds in a single `Token` table,
+    told apart by `kind` column.
+
+    Every lookup filters by kind first, so it is served by composite
+    indexes on `(kind, digest)` and `(kind, expiration_date)`.
+    """
+
+    def token_lookup(self, token_class_name):
+        return Token, {"kind": token_class_name.kind}
+
+
+class SignedTokenBackend:
+    """
+    Issues HMAC-signed, time-stamped tokens, which are not stored anywhere.
+
+    Signature covers user's password hash, `is_active` flag, last login
+    and email, so token becomes invalid once it is used.
+    """
+
+    # state fields of the user, that token is bound to
+    user_fields = ["pk", "password", "is_active", "last_login", "email"]
+    epoch = datetime(2001, 1, 1)
+
+    def create_token(
+        self, token_class_name, user, new_user=False, using=None, cooldown=None
+    ):
+        """
+        Returns signed token for given user, nothing is saved.
+        Signed tokens are not stored, so `cooldown` is not supported
+        and a new token is always returned.
+        """
+
+        state = {field: getattr(user, field) for field in self.user_fields}
+        return self.make_token(token_class_name, state, self.now())
+
+    def create_tokens(self, token_class_name, users, using=None):
+        """
+        Returns signed tokens for many users.
+        """
+
+        return [self.create_token(token_class_name, user) for user in users]
+
+    def issue_tokens(self, token_class_name, users, using=None):
+        """
+        Returns signed tokens for many users, tokens issued before
+        stay valid until they expire.
+        """
+
+        return self.create_tokens(token_class_name, users)
+
+    def consume_token(
+        self, token_class_name, token_value, using=None, validated=None, **user_fields
+    ):
+        """
+        Validate token and update given fields of its user.
+        Returns id of the user.
+
+        Takes two statements: user select and user update. The update
+        is conditional on unchanged user state, so a token can be used
+        only once, even by concurrent requests. User state is compared
+        with the update, so both statements go to primary database.
+        User select is skipped, when user state returned by
+        `validate_token` is passed as `validated`.
+
+        Raises `Http404` if token is invalid and `TokenExpiredError`
+        if token has expired.
+        """
+
+        state = validated or self.validate_token(token_class_name, token_value, using)
+
+        users = User.objects.using(using or get_write_database())
+        updated = users.filter(
+            pk=state["pk"], password=state["password"], is_active=state["is_active"]
+        ).update(**user_fields)
+        # token was used by concurrent request
+        if not updated:
+            raise Http404
+
+        return state["pk"]
+
+    def validate_token(self, token_class_name, token_value, using=None):
+        """
+        Returns state of the user, that valid token is bound to.
+
+        Raises `Http404` if token is invalid and `TokenExpiredError`
+        if token has expired.
+        """
+
+        pk, timestamp = self.parse_token(token_value)
+        users = User.objects.using(using or get_write_database())
+        state = users.filter(pk=pk).values(*self.user_fields).first()
+        self.check_token(token_class_name, token_value, state, timestamp)
+        return state
+
+    async def acreate_token(
+        self, token_class_name, user, new_user=False, using=None, cooldown=None
+    ):
+        """
+        Async version of `create_token`.
+        """
+
+        return self.create_token(token_class_name, user, new_user, using, cooldown)
+
+    async def aconsume_token(
+        self, token_class_name, token_value, using=None, validated=None, **user_fields
+    ):
+        """
+        Async version of `consume_token`.
+        """
+
+        state = validated or await self.avalidate_token(
+            token_class_name, token_value, using
+        )
+
+        users = User.objects.using(using or get_write_database())
+        updated = await users.filter(
+            pk=state["pk"], password=state["password"], is_active=state["is_active"]
+        ).aupdate(**user_fields)
+        # token was used by concurrent request
+        if not updated:
+            raise Http404
+
+        return state["pk"]
+
+    async def avalidate_token(self, token_class_name, token_value, using=None):
+        """
+        Async version of `validate_token`.
+        """
+
+        pk, timestamp = self.parse_token(token_value)
+        users = User.objects.using(using or get_write_database())
+        state = await users.filter(pk=pk).values(*self.user_fields).afirst()
+        self.check_token(token_class_name, token_value, state, timestamp)
+        return state
+
+    def parse_token(self, token_value):
+        """
+        Returns user primary key and timestamp from token value.
+        Raises `Http404` if token is malformed.
+        """
+
+        try:
+            uidb64, timestamp, _ = token_value.split(".")
+            pk = User._meta.pk.to_python(urlsafe_base64_decode(uidb64).decode())
+            return pk, base36_to_int(timestamp)
+        except (ValueError, TypeError, UnicodeDecodeError, ValidationError):
+            raise Http404
+
+    def check_token(self, token_class_name, token_value, state, timestamp):
+        """
+        Raises `Http404` if token does not match user state
+        and `TokenExpiredError` if token has expired.
+        """
+
+        if state is None:
+            raise Http404
+        # tokens signed before `SECRET_KEY` rotation stay valid
+        for secret in [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]:
+            expected = self.make_token(token_class_name, state, timestamp, secret)
+            if constant_time_compare(token_value, expected):
+                break
+        else:
+            raise Http404
+
+        lifetime = self.lifetime(token_class_name).total_seconds()
+        if timestamp + lifetime < self.now():
+            raise TokenExpiredError
+
+    def make_token(self, token_class_name, state, timestamp, secret=None):
+        """
+        Returns token value for given user state and timestamp,
+        signed with `secret`, `SECRET_KEY` by default.
+        """
+
+        last_login = state["last_login"]
+        if last_login is not None:
+            last_login = last_login.replace(microsecond=0, tzinfo=None)
+
+        value = f"{state['pk']}{state['password']}{state['is_active']}"
+        value += f"{last_login}{state['email']}{timestamp}"
+
+        key_salt = f"flash_accounts.{token_class_name.__name__}"
+        signature = salted_hmac(
+            key_salt, value, secret=secret, algorithm="sha256"
+        ).hexdigest()
+
+        uidb64 = urlsafe_base64_encode(force_bytes(state["pk"]))
+        return f"{uidb64}.{int_to_base36(timestamp)}.{signature[::2]}"
+
+    def lifetime(self, token_class_name):
+        """
+        Returns lifetime of given class name tokens.
+        """
+
+        return get_token_lifetime(token_class_name.kind)
+
+    def now(self):
+        """
+        Returns number of seconds since `epoch`.
+        """
+
+        return int((datetime.now() - self.epoch).total_seconds())
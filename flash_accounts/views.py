@@ -1,16 +1,24 @@
-from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.core.exceptions import ImproperlyConfigured
 
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import generics
 from rest_framework import status
 
-from .serializers import UserCreateSerializer, EmailSerializer, PasswordResetSerializer
-from .models import ActivationToken, PasswordResetToken
+from .throttling import IPRateThrottle, EmailRateThrottle
+from .serializers import (
+    UserCreateSerializer,
+    EmailSerializer,
+    PasswordResetSerializer,
+    TokenExportSerializer,
+)
+from .tokens import TokenExpiredError
+from .idempotency import idempotency_store
 from .settings import flash_settings
-from . import services
+from . import services, metrics
 
 
 User = get_user_model()
@@ -20,46 +28,49 @@ class UserCreateAPIView(generics.CreateAPIView):
     permission_classes = [AllowAny]
     serializer_class = UserCreateSerializer
 
+    @metrics.timed("sign_up")
+    def create(self, request, *args, **kwargs):
+        metrics.increment("sign_up")
+        return idempotency_store.handle(
+            request,
+            lambda: super(UserCreateAPIView, self).create(request, *args, **kwargs),
+        )
 
     def perform_create(self, serializer):
         """
         Save user account as inactive, create token and
         send mail with activation link.
         """
-        # Account activation
-        if flash_settings.ACTIVATE_ACCOUNT:
-            user = serializer.save(is_active=False)
-            services.create_and_send_activation_token(user, self.request)
-        else:
-            user = serializer.save()
-        user.set_password(serializer.validated_data["password"])
-        user.save()
+        services.create_user(serializer, self.request)
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@metrics.timed("activate_account")
 def activate_account(request, token_value):
     """
     Activate user account if activation token is valid.
+    Query budget: 3 queries in one transaction, which adds savepoint
+    and release queries when nested, e.g. in tests.
     """
 
-    token = get_object_or_404(ActivationToken, token=token_value)
-    if token.expired:
+    # Activate account and delete used token.
+    try:
+        services.activate_account_with_token(token_value)
+    except TokenExpiredError:
+        metrics.increment("token_expired")
         return Response(
             {"token": "token has expired."}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Activate account and delete used token.
-    user = token.user
-    user.is_active = True
-    user.save()
-    token.delete()
-
+    metrics.increment("account_activated")
     return Response({"account": "Account activated."}, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@throttle_classes([IPRateThrottle, EmailRateThrottle])
+@metrics.timed("password_reset_request")
 def password_reset_request(request):
     """
     Obtain email address, create password reset token
@@ -71,7 +82,9 @@ def password_reset_request(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     email = serializer.data["email"]
-    user = get_object_or_404(User, email=email)
+    user = services.get_user_by_email(email)
+    if user is None:
+        raise Http404
 
     services.create_and_send_password_reset_token(user, request)
 
@@ -83,6 +96,8 @@ def password_reset_request(request):
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@throttle_classes([IPRateThrottle, EmailRateThrottle])
+@metrics.timed("account_activation_resend")
 def account_activation_resend(request):
     """
     Obtain email address, create activation token
@@ -95,7 +110,9 @@ def account_activation_resend(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     email = serializer.data["email"]
-    user = get_object_or_404(User, email=email)
+    user = services.get_user_by_email(email)
+    if user is None:
+        raise Http404
 
     if user.is_active:
         return Response(
@@ -112,28 +129,71 @@ def account_activation_resend(request):
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@metrics.timed("password_reset_confirm")
 def password_reset_confirm(request, token_value):
     """
     Set new password if token and serializer data is valid.
+    Query budget: 3 queries in one transaction, which adds savepoint
+    and release queries when nested, e.g. in tests.
     """
 
     serializer = PasswordResetSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    token = get_object_or_404(PasswordResetToken, token=token_value)
-    if token.expired:
+    # set new password and delete used token.
+    new_password = serializer.validated_data["password"]
+    try:
+        services.reset_password_with_token(token_value, new_password)
+    except TokenExpiredError:
+        metrics.increment("token_expired")
         return Response(
             {"token": "token has expired."}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    # set new password and delete used token.
-    user = token.user
-    new_password = serializer.validated_data["password"]
-    user.set_password(new_password)
-    user.save()
-    token.delete()
-
+    metrics.increment("password_changed")
     return Response(
         {"password": "Password has been changed."}, status=status.HTTP_200_OK
     )
+
+
+def metrics_view(request):
+    """
+    Expose metrics aggregated by metrics backend in Prometheus text format.
+    """
+
+    return HttpResponse(
+        metrics.get_metrics().render_prometheus(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def export_tokens_view(request):
+    """
+    Stream CSV or JSONL export of tokens of given kind joined with
+    fields of their users to staff users. Memory use stays constant
+    no matter how many tokens are exported.
+    """
+
+    serializer = TokenExportSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    filters = dict(serializer.validated_data)
+    kind = filters.pop("kind")
+    file_format = filters.pop("file_format")
+
+    # resolved before streaming starts, so error is not sent as a 200 body
+    try:
+        rows = services.export_tokens(services.TOKEN_CLASSES[kind], **filters)
+    except ImproperlyConfigured as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        services.format_rows(rows, file_format, services.TOKEN_EXPORT_COLUMNS),
+        content_type="text/csv" if file_format == "csv" else "application/jsonl",
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{kind}_tokens.{file_format}"'
+    )
+    return response